@@ -1,35 +1,79 @@
 import fastapi
+import fastapi.concurrency
 import fastapi.responses
+import math
 import os
 import pathlib
 import uuid
 
-from typing import Tuple
+from typing import Optional, Tuple
 
+from nanopub_submitter.cache import NanopubCache, ARTIFACT_CODE_PATTERN, render
+from nanopub_submitter.capture import Capture, CaptureMiddleware
+from nanopub_submitter.compression import read_body, CompressionError
 from nanopub_submitter.config import cfg_parser, RequestConfig
 from nanopub_submitter.consts import NICE_NAME, VERSION, BUILD_INFO, \
-    ENV_CONFIG, DEFAULT_CONFIG, DEFAULT_ENCODING
+    ENV_CONFIG, DEFAULT_CONFIG, DEFAULT_ENCODING, INPUT_FORMATS, \
+    FORMAT_TRIG, FORMAT_MEDIA_TYPES, FORMAT_EXTENSIONS
+from nanopub_submitter.dedup import ExistenceChecker
+from nanopub_submitter.health import Health
+from nanopub_submitter.limits import SubmissionLimiter, Lane
 from nanopub_submitter.logger import LOG, init_default_logging, init_config_logging
 from nanopub_submitter.mailer import Mailer
-from nanopub_submitter.nanopub import process, NanopubProcessingError
+from nanopub_submitter.nanopub import process, NanopubProcessingError, \
+    deliver_publish, deliver_triple_store
+from nanopub_submitter.outbox import Outbox, OutboxEntry, \
+    KIND_PUBLISH, KIND_TRIPLE_STORE, KIND_MAIL
+from nanopub_submitter.offload import Offload
+from nanopub_submitter.profiling import Profiler, ProfilerBusyError, \
+    PROFILE_HEADER, PROFILE_ID_HEADER
+from nanopub_submitter.tracing import Trace, Tracer, TRACEPARENT_HEADER
+from nanopub_submitter.validation import count_this_prefixes
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 
 app = fastapi.FastAPI(
     title=NICE_NAME,
     version=VERSION,
 )
+app.add_middleware(CaptureMiddleware)
 cfg = cfg_parser.config
 
 
-def _valid_token(request: fastapi.Request) -> bool:
+def _authorize(request: fastapi.Request) -> Optional[str]:
+    # returns tenant (token hash or client host) if authorized
     if not cfg.security.enabled:
         LOG.debug('Security disabled, authorized directly')
-        return True
+        return request.client.host if request.client else 'anonymous'
     auth = request.headers.get('Authorization', '')  # type: str
     if not auth.startswith('Bearer '):
         LOG.debug('Invalid token (missing or without "Bearer " prefix')
+        return None
+    token = auth.split(' ', maxsplit=1)[1]
+    return cfg.security.match_token(token)
+
+
+def _is_admin(request: fastapi.Request) -> bool:
+    # admin token is required even with security disabled
+    auth = request.headers.get('Authorization', '')  # type: str
+    if not auth.startswith('Bearer '):
         return False
     token = auth.split(' ', maxsplit=1)[1]
-    return token in cfg.security.tokens
+    return cfg.security.is_admin(cfg.security.match_token(token))
+
+
+def _admin_error(request: fastapi.Request) -> Optional[fastapi.responses.Response]:
+    if not Profiler.get().enabled:
+        return fastapi.responses.PlainTextResponse(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            content='Profiling is disabled.\n',
+        )
+    if not _is_admin(request=request):
+        return fastapi.responses.PlainTextResponse(
+            status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
+            content='Unauthorized admin request.\n',
+        )
+    return None
 
 
 def _extract_content_type(header: str) -> Tuple[str, str]:
@@ -49,6 +93,40 @@ def _extract_servers(header: str) -> list[str]:
     return list(map(lambda x: x.strip(), header.split(',')))
 
 
+def _negotiate_format(header: str) -> Optional[str]:
+    if header.strip() == '':
+        return FORMAT_TRIG
+    best, best_q = None, 0.0
+    for media_range in header.lower().split(','):
+        params = media_range.split(';')
+        media_type = params[0].strip()
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in ('*/*', 'application/*'):
+            candidate = FORMAT_TRIG  # type: Optional[str]
+        else:
+            candidate = INPUT_FORMATS.get(media_type, None)
+        if candidate is not None and q > best_q:
+            best, best_q = candidate, q
+    return best
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag in ('*', etag):
+            return True
+    return False
+
+
 @app.get(path='/')
 async def get_info():
     return fastapi.responses.JSONResponse(
@@ -56,52 +134,262 @@ async def get_info():
     )
 
 
+@app.get(path='/health/live')
+async def get_liveness():
+    return fastapi.responses.JSONResponse(
+        content=Health.get().live,
+    )
+
+
+@app.get(path='/health/ready')
+async def get_readiness():
+    health = Health.get()
+    return fastapi.responses.JSONResponse(
+        status_code=fastapi.status.HTTP_200_OK if health.ready
+        else fastapi.status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=health.readiness,
+    )
+
+
+@app.get(path='/admin/profile')
+async def get_profile(request: fastapi.Request, seconds: float = 10, interval: float = 0.01):
+    error = _admin_error(request=request)
+    if error is not None:
+        return error
+    try:
+        folded = await fastapi.concurrency.run_in_threadpool(
+            Profiler.get().sample,
+            seconds=seconds,
+            interval=interval,
+        )
+    except ProfilerBusyError as e:
+        return fastapi.responses.PlainTextResponse(
+            status_code=fastapi.status.HTTP_409_CONFLICT,
+            content=f'{str(e)}\n',
+        )
+    return fastapi.responses.PlainTextResponse(content=folded)
+
+
+@app.get(path='/admin/profile/{profile_id}')
+async def get_submission_profile(request: fastapi.Request, profile_id: str):
+    error = _admin_error(request=request)
+    if error is not None:
+        return error
+    try:
+        profile_id = str(uuid.UUID(profile_id))
+    except ValueError:
+        profile_id = ''
+    path = Profiler.get().find_profile(profile_id) if profile_id else None
+    if path is None:
+        return fastapi.responses.PlainTextResponse(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            content='Profile not found.\n',
+        )
+    return fastapi.responses.FileResponse(
+        path=path,
+        media_type='application/octet-stream',
+        filename=path.name,
+    )
+
+
+@app.get(path='/nanopubs/{artifact_code}')
+async def get_nanopub(request: fastapi.Request, artifact_code: str):
+    cache = NanopubCache.get()
+    if not cache.enabled or ARTIFACT_CODE_PATTERN.match(artifact_code) is None:
+        return fastapi.responses.PlainTextResponse(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            content='Nanopublication not found.\n',
+        )
+    output_format = _negotiate_format(request.headers.get('Accept', ''))
+    if output_format is None:
+        return fastapi.responses.PlainTextResponse(
+            status_code=fastapi.status.HTTP_406_NOT_ACCEPTABLE,
+            content=f'Supported formats: {", ".join(FORMAT_MEDIA_TYPES.values())}\n',
+        )
+    # trusty hash is part of the code, content never changes
+    headers = {
+        'ETag': f'"{artifact_code}.{FORMAT_EXTENSIONS[output_format]}"',
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL,
+        'Vary': 'Accept',
+    }
+    data = await fastapi.concurrency.run_in_threadpool(cache.lookup, artifact_code)
+    if data is None:
+        return fastapi.responses.PlainTextResponse(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            content='Nanopublication not found.\n',
+        )
+    if _etag_matches(request.headers.get('If-None-Match', ''), headers['ETag']):
+        return fastapi.responses.Response(
+            status_code=fastapi.status.HTTP_304_NOT_MODIFIED,
+            headers=headers,
+        )
+    if output_format != FORMAT_TRIG:
+        data = await fastapi.concurrency.run_in_threadpool(render, data, output_format)
+    return fastapi.responses.Response(
+        content=data,
+        media_type=FORMAT_MEDIA_TYPES[output_format],
+        headers=headers,
+    )
+
+
 @app.post(path='/submit')
 async def submit_nanopub(request: fastapi.Request):
     # (1) Verify authorization
-    if not _valid_token(request=request):
+    tenant = _authorize(request=request)
+    if tenant is None:
         return fastapi.responses.PlainTextResponse(
             status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
             content='Unauthorized submission request.\n\n'
                     'The submission service is not configured properly.\n'
         )
+    limiter = SubmissionLimiter.get()
+    retry_after = limiter.admit(tenant)
+    if retry_after is not None:
+        return _too_many_requests(retry_after=retry_after)
+    try:
+        return await _submit_nanopub(request=request, tenant=tenant)
+    finally:
+        limiter.finish(tenant)
+
+
+def _too_many_requests(retry_after: float):
+    return fastapi.responses.PlainTextResponse(
+        status_code=fastapi.status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={'Retry-After': str(math.ceil(retry_after))},
+        content='Too many submission requests, try again later.\n',
+    )
+
+
+def _decode_body(data: bytes, encoding: str, input_format: str) -> Tuple[str, int]:
+    # returns text and number of nanopubs (for lanes, counted for TriG only)
+    text = data.decode(encoding)
+    if input_format == FORMAT_TRIG:
+        return text, count_this_prefixes(text)
+    return text, 0
+
+
+async def _submit_nanopub(request: fastapi.Request, tenant: str):
     # (2) Extract data
     submission_id = str(uuid.uuid4())
-    data = await request.body()
-    input_format, encoding = _extract_content_type(request.headers.get('Content-Type', ''))
+    request.state.submission_id = submission_id
+    try:
+        data = await read_body(
+            stream=request.stream(),
+            encoding=request.headers.get('Content-Encoding', ''),
+            max_size=cfg.nanopub.max_body_size,
+        )
+    except CompressionError as e:
+        return fastapi.responses.PlainTextResponse(
+            status_code=e.status_code,
+            content=f'{e.message}\n',
+        )
+    content_type, encoding = _extract_content_type(request.headers.get('Content-Type', ''))
     req_cfg = RequestConfig(
         servers=_extract_servers(request.headers.get('X-NP-Servers', '')),
         uri_replace=request.headers.get('X-URI-Replace', None)
     )
-    if input_format != 'application/trig':
+    input_format = INPUT_FORMATS.get(content_type, None)
+    if input_format is None:
         return fastapi.responses.Response(
             status_code=fastapi.status.HTTP_400_BAD_REQUEST,
-            content=f'Unsupported content-type: {input_format}\n'
-                    f'Nanopublication must be in TriG format'
+            content=f'Unsupported content-type: {content_type}\n'
+                    f'Nanopublication must be in TriG, N-Quads or JSON-LD format'
         )
-    # (3) Process
     try:
-        result = process(
-            cfg=cfg,
-            req_cfg=req_cfg,
-            submission_id=submission_id,
-            data=data.decode(encoding),
+        # may be large, keep event loop free for other requests
+        text, nanopubs = await fastapi.concurrency.run_in_threadpool(
+            _decode_body, data, encoding, input_format,
+        )
+    except (UnicodeDecodeError, LookupError) as e:
+        return fastapi.responses.PlainTextResponse(
+            status_code=fastapi.status.HTTP_400_BAD_REQUEST,
+            content=f'Failed to decode body ({encoding}): {e}\n',
         )
+    limiter = SubmissionLimiter.get()
+    lane = limiter.lane(size=len(data), nanopubs=nanopubs)
+    retry_after = limiter.admit_lane(tenant, lane)
+    if retry_after is not None:
+        return _too_many_requests(retry_after=retry_after)
+    if lane is not None:
+        req_cfg.timeout_factor = lane.config.timeout_factor
+    # (3) Process
+    trace = Tracer.get().start(
+        submission_id=submission_id,
+        traceparent=request.headers.get(TRACEPARENT_HEADER, None),
+        record=Capture.get().enabled,
+    )
+    try:
+        with trace.span('submit', **{'tenant': tenant[:8], 'input.size': len(data),
+                                     'lane': lane.name if lane is not None else ''}):
+            return await _process_nanopub(
+                submission_id=submission_id,
+                tenant=tenant,
+                req_cfg=req_cfg,
+                data=text,
+                input_format=input_format,
+                trace=trace,
+                profile=_profile_requested(request=request),
+                lane=lane,
+            )
+    finally:
+        limiter.finish_lane(tenant, lane)
+        request.state.stages = trace.timings()
+        trace.finish()
+
+
+def _profile_requested(request: fastapi.Request) -> bool:
+    if request.headers.get(PROFILE_HEADER, '').lower() != 'true':
+        return False
+    return Profiler.get().enabled and _is_admin(request=request)
+
+
+def _run_process(profile: bool, **kwargs):
+    if profile:
+        return Profiler.get().profile_call(kwargs['submission_id'], process, **kwargs)
+    return process(**kwargs)
+
+
+async def _process_nanopub(submission_id: str, tenant: str, req_cfg: RequestConfig,
+                           data: str, input_format: str, trace: Trace, profile: bool,
+                           lane: Optional[Lane] = None):
+    try:
+        async with SubmissionLimiter.get().slot(tenant, lane):
+            result = await fastapi.concurrency.run_in_threadpool(
+                _run_process,
+                profile=profile,
+                cfg=cfg,
+                req_cfg=req_cfg,
+                submission_id=submission_id,
+                data=data,
+                input_format=input_format,
+                trace=trace,
+            )
     except NanopubProcessingError as e:
         return fastapi.responses.PlainTextResponse(
             status_code=e.status_code,
             content=e.message,
         )
     except Exception as e:
-        LOG.error(f'[{submission_id}] Unexpected processing error: {str(e)}')
+        LOG.error('Unexpected processing error: %s', e,
+                  extra={'submission_id': submission_id})
         return fastapi.responses.PlainTextResponse(
             status_code=fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=f'Failed to process the nanopublication: {str(e)}',
         )
-    # (4) Mail
-    Mailer.get().notice(nanopub_uri=result.location)
+    # (4) Mail (unless queued in outbox)
+    if not result.mail_queued:
+        with trace.span('smtp'):
+            await fastapi.concurrency.run_in_threadpool(
+                Mailer.get().notice,
+                nanopub_uri=result.location,
+            )
     # (5) Return
-    headers = dict()
+    headers = dict()  # type: dict[str, str]
+    traceparent = trace.traceparent
+    if trace.recording and Tracer.get().enabled and traceparent is not None:
+        headers[TRACEPARENT_HEADER] = traceparent
+    if profile:
+        headers[PROFILE_ID_HEADER] = submission_id
     if result.location is not None:
         headers['Location'] = result.location
     return fastapi.responses.Response(
@@ -111,6 +399,17 @@ async def submit_nanopub(request: fastapi.Request):
     )
 
 
+def _deliver_mail(config, entry: OutboxEntry):
+    Mailer.get().send_notice(nanopub_uri=entry.uri)
+
+
+OUTBOX_HANDLERS = {
+    KIND_PUBLISH: deliver_publish,
+    KIND_TRIPLE_STORE: deliver_triple_store,
+    KIND_MAIL: _deliver_mail,
+}
+
+
 @app.on_event("startup")
 async def app_init():
     global cfg
@@ -121,7 +420,19 @@ async def app_init():
             cfg = cfg_parser.parse_file(fp=fp)
         init_config_logging(config=cfg)
         Mailer.init(config=cfg)
+        SubmissionLimiter.init(config=cfg)
+        Tracer.init(config=cfg)
+        Profiler.init(config=cfg)
+        Outbox.init(config=cfg, handlers=OUTBOX_HANDLERS)
+        NanopubCache.init(config=cfg)
+        Capture.init(config=cfg)
+        Offload.init(config=cfg)
+        ExistenceChecker.init(config=cfg)
     except Exception as e:
-        LOG.warn(f'Failed to load config: {config_file}')
-        LOG.debug(str(e))
-    LOG.info(f'Loaded config: {config_file}')
+        LOG.warning('Failed to load config: %s', config_file)
+        LOG.debug('%s', e)
+        Health.init(config=cfg, config_loaded=False)
+        return
+    LOG.info('Loaded config: %s', config_file)
+    Health.init(config=cfg, config_loaded=True)
+    Health.get().start_warmup()
@@ -0,0 +1,317 @@
+import argparse
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+
+from typing import Iterator, Optional, Tuple
+
+from nanopub_submitter.config import cfg_parser, SubmitterConfig, RequestConfig
+from nanopub_submitter.consts import ENV_CONFIG, DEFAULT_CONFIG, DEFAULT_ENCODING, \
+    FORMAT_TRIG
+from nanopub_submitter.dedup import ExistenceChecker
+from nanopub_submitter.logger import LOG, init_config_logging
+from nanopub_submitter.nanopub import process, warm_up, NanopubProcessingError
+from nanopub_submitter.triple_store import build_query, update_triple_store
+
+TRIG_SUFFIX = '.trig'
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+STATUS_PUBLISHED = 'published'
+STATUS_STORED = 'stored'
+STATUS_FAILED = 'failed'
+
+# files read ahead per worker (pool consumes tasks eagerly otherwise)
+IN_FLIGHT_PER_JOB = 4
+
+_WORKER_CFG = None  # type: Optional[SubmitterConfig]
+
+
+def _load_config(config_file: str) -> SubmitterConfig:
+    with pathlib.Path(config_file).open() as fp:
+        return cfg_parser.parse_file(fp=fp)
+
+
+def iter_sources(source: pathlib.Path) -> Iterator[Tuple[str, str]]:
+    """Yields (name, content) of TriG files in a directory or archive"""
+    if source.is_dir():
+        for path in sorted(source.rglob(f'*{TRIG_SUFFIX}')):
+            yield str(path.relative_to(source)), path.read_text(encoding=DEFAULT_ENCODING)
+    elif source.name.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                if name.endswith(TRIG_SUFFIX):
+                    yield name, archive.read(name).decode(DEFAULT_ENCODING)
+    elif source.name.endswith(TAR_SUFFIXES):
+        with tarfile.open(source) as archive:
+            for member in archive:
+                f = archive.extractfile(member) if member.isfile() else None
+                if f is not None and member.name.endswith(TRIG_SUFFIX):
+                    yield member.name, f.read().decode(DEFAULT_ENCODING)
+    else:
+        raise ValueError(f'Not a directory or supported archive: {source}')
+
+
+class Journal:
+    """Append-only JSON lines of processed files (for resuming)"""
+
+    def __init__(self, path: pathlib.Path, store: bool):
+        self.path = path
+        self.done = set()  # type: set[str]
+        self.unstored = dict()  # type: dict[str, str]
+        self._load(store=store)
+        self.fp = self.path.open('a', encoding=DEFAULT_ENCODING)
+
+    def _load(self, store: bool):
+        if self.path.exists():
+            with self.path.open(encoding=DEFAULT_ENCODING) as fp:
+                for line in fp:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # partially written last line
+                    self._apply(entry, store=store)
+
+    def _apply(self, entry: dict, store: bool):
+        name, status = entry.get('file', ''), entry.get('status', '')
+        if status == STATUS_PUBLISHED:
+            if store:
+                self.unstored[name] = entry.get('nanopub', '')
+            else:
+                self.done.add(name)
+        elif status == STATUS_STORED:
+            self.unstored.pop(name, None)
+            self.done.add(name)
+
+    def write(self, name: str, status: str, **fields):
+        entry = {'file': name, 'status': status, 'time': time.time(), **fields}
+        self.fp.write(json.dumps(entry) + '\n')
+        self.fp.flush()
+
+    def close(self):
+        if not self.fp.closed:
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+            self.fp.close()
+
+
+class Stats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.skipped = 0
+        self.published = 0
+        self.failed = 0
+        self.stored = 0
+        self.store_failed = 0
+        self.durations = []  # type: list[float]
+
+    def percentile(self, p: float) -> float:
+        if len(self.durations) == 0:
+            return 0.0
+        values = sorted(self.durations)
+        return values[min(int(len(values) * p), len(values) - 1)]
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.started
+        rate = self.published / elapsed if elapsed > 0 else 0.0
+        return '\n'.join([
+            f'Published:      {self.published}',
+            f'Failed:         {self.failed}',
+            f'Skipped:        {self.skipped} (already in journal)',
+            f'Triple store:   {self.stored} stored, {self.store_failed} failed',
+            f'Elapsed:        {elapsed:.1f}s',
+            f'Throughput:     {rate:.2f} nanopubs/s',
+            f'Latency:        p50={self.percentile(0.5):.2f}s '
+            f'p95={self.percentile(0.95):.2f}s max={self.percentile(1.0):.2f}s',
+        ])
+
+
+def _init_worker(config_file: str):
+    global _WORKER_CFG
+    cfg = _load_config(config_file)
+    init_config_logging(config=cfg)
+    # triple store is written in batches by the main process
+    cfg.triple_store.enabled = False
+    cfg.mail.enabled = False
+    ExistenceChecker.init(config=cfg)
+    warm_up(cfg)
+    _WORKER_CFG = cfg
+
+
+def _import_one(item: Tuple[str, str]) -> dict:
+    name, data = item
+    if _WORKER_CFG is None:
+        raise RuntimeError('Worker is not initialized')
+    start = time.monotonic()
+    try:
+        result = process(
+            cfg=_WORKER_CFG,
+            req_cfg=RequestConfig(servers=[], uri_replace=None),
+            submission_id=str(uuid.uuid4()),
+            data=data,
+            input_format=FORMAT_TRIG,
+        )
+    except NanopubProcessingError as e:
+        return {'file': name, 'ok': False, 'error': e.message,
+                'duration': time.monotonic() - start}
+    except Exception as e:
+        return {'file': name, 'ok': False, 'error': str(e),
+                'duration': time.monotonic() - start}
+    return {'file': name, 'ok': True, 'uri': result.location,
+            'servers': result.servers, 'nanopub': result.nanopub,
+            'duration': time.monotonic() - start}
+
+
+class BulkImporter:
+
+    def __init__(self, cfg: SubmitterConfig, config_file: str, journal: Journal,
+                 jobs: int, batch_size: int):
+        self.cfg = cfg
+        self.config_file = config_file
+        self.journal = journal
+        self.jobs = jobs
+        self.batch_size = batch_size
+        self.batch = dict()  # type: dict[str, str]
+        self.stats = Stats()
+        self.slots = threading.Semaphore(max(jobs, 1) * IN_FLIGHT_PER_JOB)
+        self.stopped = threading.Event()
+
+    @property
+    def store(self) -> bool:
+        return self.cfg.triple_store.enabled
+
+    def _pending(self, source: pathlib.Path) -> Iterator[Tuple[str, str]]:
+        for name, data in iter_sources(source):
+            if name in self.journal.done or name in self.journal.unstored:
+                self.stats.skipped += 1
+                continue
+            yield name, data
+
+    def _bounded(self, tasks: Iterator[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+        # called from pool task handler thread, blocks until a result is handled
+        for task in tasks:
+            self.slots.acquire()
+            if self.stopped.is_set():
+                return
+            yield task
+
+    def _flush(self):
+        if len(self.batch) == 0:
+            return
+        names = list(self.batch.keys())
+        try:
+            # one update per submission (as /submit does), sent in one request
+            query = '\n'.join(
+                build_query(cfg=self.cfg, data=nanopub, input_format=FORMAT_TRIG)
+                for nanopub in self.batch.values()
+            )
+            update_triple_store(cfg=self.cfg, query=query)
+        except Exception as e:
+            LOG.warning('Failed to store batch of %d nanopub(s): %s', len(names), e)
+            self.stats.store_failed += len(names)
+        else:
+            for name in names:
+                self.journal.write(name, STATUS_STORED)
+            self.stats.stored += len(names)
+        self.batch.clear()
+
+    def _add_to_batch(self, name: str, nanopub: str):
+        self.batch[name] = nanopub
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def _handle(self, result: dict):
+        name = result['file']
+        self.stats.durations.append(result['duration'])
+        if not result['ok']:
+            self.stats.failed += 1
+            LOG.warning('Failed to import %s: %s', name, result['error'])
+            self.journal.write(name, STATUS_FAILED, error=result['error'])
+            return
+        self.stats.published += 1
+        self.journal.write(
+            name, STATUS_PUBLISHED,
+            uri=result['uri'],
+            servers=result['servers'],
+            nanopub=result['nanopub'] if self.store else None,
+        )
+        if self.store:
+            self._add_to_batch(name, result['nanopub'])
+
+    def run(self, source: pathlib.Path):
+        if self.store:
+            # published before an interruption but not stored yet
+            for name, nanopub in self.journal.unstored.items():
+                self._add_to_batch(name, nanopub)
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes=self.jobs, initializer=_init_worker,
+                          initargs=(self.config_file,)) as pool:
+            try:
+                tasks = self._bounded(self._pending(source))
+                for result in pool.imap_unordered(_import_one, tasks):
+                    self.slots.release()
+                    self._handle(result)
+            finally:
+                # unblock task handler so that pool can terminate
+                self.stopped.set()
+                self.slots.release()
+                self._flush()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='nanopub-bulk-import',
+        description='Publish TriG files from a directory or archive '
+                    '(same pipeline as /submit)',
+    )
+    parser.add_argument('source', type=pathlib.Path,
+                        help='directory or archive (zip, tar) with TriG files')
+    parser.add_argument('-c', '--config', default=os.getenv(ENV_CONFIG, DEFAULT_CONFIG),
+                        help='configuration file (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes (default: %(default)s)')
+    parser.add_argument('-b', '--batch-size', type=int, default=50,
+                        help='nanopubs per triple store update (default: %(default)s)')
+    parser.add_argument('--journal', type=pathlib.Path, default=None,
+                        help='progress journal (default: <source>.journal)')
+    args = parser.parse_args(argv)
+
+    cfg = _load_config(args.config)
+    init_config_logging(config=cfg)
+    journal = Journal(
+        path=args.journal or pathlib.Path(f'{str(args.source).rstrip("/")}.journal'),
+        store=cfg.triple_store.enabled,
+    )
+    importer = BulkImporter(
+        cfg=cfg,
+        config_file=args.config,
+        journal=journal,
+        jobs=max(args.jobs, 1),
+        batch_size=max(args.batch_size, 1),
+    )
+    exit_code = 0
+    try:
+        importer.run(source=args.source)
+    except KeyboardInterrupt:
+        LOG.warning('Interrupted, progress saved to %s', journal.path)
+        exit_code = 130
+    except Exception as e:
+        LOG.error('Bulk import failed: %s', e)
+        exit_code = 1
+    finally:
+        journal.close()
+    print(importer.stats.report())
+    if exit_code == 0 and (importer.stats.failed > 0 or importer.stats.store_failed > 0):
+        exit_code = 2
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import collections
+import pathlib
+import re
+import threading
+
+from typing import Optional
+
+from nanopub_submitter.config import SubmitterConfig
+from nanopub_submitter.connections import get_session
+from nanopub_submitter.consts import FORMAT_TRIG
+from nanopub_submitter.logger import LOG
+
+ARTIFACT_CODE_PATTERN = re.compile(r'^[A-Za-z0-9_\-]+$')
+SPILL_EXTENSION = '.trig'
+
+
+def artifact_code(uri: str) -> Optional[str]:
+    """Last segment of (trusty) nanopub URI, e.g. RA..."""
+    code = uri.split('#', maxsplit=1)[0].rstrip('/').rsplit('/', maxsplit=1)[-1]
+    if ARTIFACT_CODE_PATTERN.match(code) is None:
+        return None
+    return code
+
+
+def render(data: bytes, output_format: str) -> bytes:
+    if output_format == FORMAT_TRIG:
+        return data
+    import rdflib  # type: ignore
+    graph = rdflib.ConjunctiveGraph()
+    graph.parse(data=data, format=FORMAT_TRIG)
+    result = graph.serialize(format=output_format, encoding='utf-8')
+    return result if isinstance(result, bytes) else result.encode('utf-8')
+
+
+class NanopubCache:
+    """Size-bounded LRU of published nanopubs (TriG) with optional disk spill"""
+    _instance = None
+
+    def __init__(self):
+        self.cfg = None
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # type: collections.OrderedDict[str, bytes]
+        self.size = 0
+        self.spilled = collections.OrderedDict()  # type: collections.OrderedDict[str, int]
+        self.spilled_size = 0
+
+    @classmethod
+    def init(cls, config: SubmitterConfig):
+        instance = cls.get()
+        with instance.lock:
+            instance.cfg = config
+            instance.entries.clear()
+            instance.size = 0
+            instance.spilled.clear()
+            instance.spilled_size = 0
+            if instance.enabled and instance.spill_dir is not None:
+                instance._load_spilled()
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = NanopubCache()
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.cfg is not None and self.cfg.cache.enabled
+
+    @property
+    def spill_dir(self) -> Optional[pathlib.Path]:
+        if not self.cfg.cache.spill_directory:
+            return None
+        return pathlib.Path(self.cfg.cache.spill_directory)
+
+    def _spill_path(self, code: str) -> pathlib.Path:
+        return pathlib.Path(self.cfg.cache.spill_directory) / f'{code}{SPILL_EXTENSION}'
+
+    def _load_spilled(self):
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.spill_dir.glob(f'*{SPILL_EXTENSION}'),
+                       key=lambda f: f.stat().st_mtime)
+        for file in files:
+            size = file.stat().st_size
+            self.spilled[file.stem] = size
+            self.spilled_size += size
+        self._trim_spilled()
+        LOG.info('Nanopub cache: %d spilled nanopub(s) in %s',
+                 len(self.spilled), self.spill_dir)
+
+    def put(self, code: str, data: bytes):
+        if not self.enabled or len(data) > self.cfg.cache.max_size:
+            return
+        with self.lock:
+            self._put(code, data)
+
+    def _put(self, code: str, data: bytes):
+        if code in self.entries:
+            self.entries.move_to_end(code)
+            return
+        self.entries[code] = data
+        self.size += len(data)
+        while self.size > self.cfg.cache.max_size:
+            old_code, old_data = self.entries.popitem(last=False)
+            self.size -= len(old_data)
+            self._spill(old_code, old_data)
+
+    def _spill(self, code: str, data: bytes):
+        if self.spill_dir is None or code in self.spilled:
+            return
+        try:
+            self._spill_path(code).write_bytes(data)
+        except Exception as e:
+            LOG.warning('Failed to spill nanopub %s to disk: %s', code, e)
+            return
+        self.spilled[code] = len(data)
+        self.spilled_size += len(data)
+        self._trim_spilled()
+
+    def _trim_spilled(self):
+        while self.spilled_size > self.cfg.cache.spill_max_size and len(self.spilled) > 0:
+            code, size = self.spilled.popitem(last=False)
+            self.spilled_size -= size
+            self._spill_path(code).unlink(missing_ok=True)
+
+    def _get_local(self, code: str) -> Optional[bytes]:
+        with self.lock:
+            data = self.entries.get(code, None)
+            if data is not None:
+                self.entries.move_to_end(code)
+                return data
+            if code not in self.spilled:
+                return None
+            try:
+                data = self._spill_path(code).read_bytes()
+            except Exception as e:
+                LOG.warning('Failed to read spilled nanopub %s: %s', code, e)
+                return None
+            self.spilled.move_to_end(code)
+            self._put(code, data)
+            return data
+
+    def _fetch(self, code: str) -> Optional[bytes]:
+        for server in self.cfg.nanopub.servers:
+            url = f'{server.rstrip("/")}/{code}.trig'
+            try:
+                r = get_session().get(url=url, timeout=self.cfg.cache.timeout)
+            except Exception as e:
+                LOG.debug('Failed to fetch nanopub %s: %s', url, e)
+                continue
+            if r.ok and code.encode('utf-8') in r.content:
+                LOG.debug('Nanopub %s fetched from %s', code, server)
+                return r.content
+        return None
+
+    def lookup(self, code: str) -> Optional[bytes]:
+        """Cached nanopub (TriG), read-through to nanopub servers on a miss"""
+        if not self.enabled:
+            return None
+        data = self._get_local(code)
+        if data is not None or not self.cfg.cache.read_through:
+            return data
+        data = self._fetch(code)
+        if data is not None:
+            self.put(code, data)
+        return data
@@ -0,0 +1,148 @@
+import atexit
+import base64
+import json
+import pathlib
+import queue
+import threading
+import time
+
+from typing import Optional  # noqa: F401
+
+from nanopub_submitter.config import SubmitterConfig
+from nanopub_submitter.logger import LOG
+
+CAPTURE_PATH = '/submit'
+CAPTURE_HEADERS = (
+    'content-type',
+    'content-encoding',
+    'x-np-servers',
+    'x-uri-replace',
+    'traceparent',
+)
+REDACTED = '<redacted>'
+
+
+class Capture:
+    """Writes submit requests as JSON lines (for replaying them later)"""
+    _instance = None
+
+    def __init__(self):
+        self.cfg = None
+        self.queue = queue.SimpleQueue()  # type: queue.SimpleQueue
+        self.thread = None  # type: Optional[threading.Thread]
+
+    @classmethod
+    def init(cls, config: SubmitterConfig):
+        instance = cls.get()
+        instance.shutdown()
+        instance.cfg = config
+        if not config.capture.enabled:
+            return
+        pathlib.Path(config.capture.file).parent.mkdir(parents=True, exist_ok=True)
+        instance.thread = threading.Thread(
+            target=instance._run,
+            name='capture-writer',
+            daemon=True,
+        )
+        instance.thread.start()
+        LOG.info('Capturing submissions to %s', config.capture.file)
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = Capture()
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.thread is not None
+
+    @property
+    def max_body_size(self) -> int:
+        return self.cfg.capture.max_body_size
+
+    def record(self, entry: dict):
+        if self.enabled:
+            self.queue.put(entry)
+
+    def _run(self):
+        with open(self.cfg.capture.file, 'a', encoding='utf-8') as fp:
+            while True:
+                entry = self.queue.get()
+                if entry is None:
+                    return
+                try:
+                    fp.write(json.dumps(entry) + '\n')
+                    if self.queue.empty():
+                        fp.flush()
+                except Exception as e:
+                    LOG.warning('Failed to write captured request: %s', e)
+
+    def shutdown(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+            self.thread = None
+
+
+def _captured_headers(scope) -> dict[str, str]:
+    headers = dict()  # type: dict[str, str]
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').lower()
+        if key in CAPTURE_HEADERS:
+            headers[key] = value.decode('latin-1')
+        elif key == 'authorization':
+            # tokens never get into the capture
+            headers[key] = REDACTED
+    return headers
+
+
+class CaptureMiddleware:
+    """ASGI middleware copying /submit requests (raw body) to the capture"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        capture = Capture.get()
+        if scope['type'] != 'http' or scope['path'] != CAPTURE_PATH \
+                or scope['method'] != 'POST' or not capture.enabled:
+            await self.app(scope, receive, send)
+            return
+        arrival = time.time()
+        start = time.perf_counter()
+        chunks = []  # type: list[bytes]
+        state = {'size': 0, 'status': 0}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message['type'] == 'http.request':
+                body = message.get('body', b'')
+                state['size'] += len(body)
+                if state['size'] <= capture.max_body_size:
+                    chunks.append(body)
+            return message
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            request_state = scope.get('state', {})
+            truncated = state['size'] > capture.max_body_size
+            capture.record({
+                'arrival': arrival,
+                'submission_id': request_state.get('submission_id', None),
+                'headers': _captured_headers(scope),
+                'body': None if truncated else base64.b64encode(b''.join(chunks)).decode('ascii'),
+                'body_size': state['size'],
+                'status': state['status'],
+                'duration': time.perf_counter() - start,
+                'stages': request_state.get('stages', {}),
+            })
+
+
+atexit.register(lambda: Capture.get().shutdown())
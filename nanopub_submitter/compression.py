@@ -0,0 +1,116 @@
+import gzip
+import zlib
+import zstandard
+
+from typing import AsyncIterator
+
+ENCODING_IDENTITY = 'identity'
+ENCODING_GZIP = 'gzip'
+ENCODING_ZSTD = 'zstd'
+
+SUPPORTED_ENCODINGS = (ENCODING_IDENTITY, ENCODING_GZIP, ENCODING_ZSTD)
+
+CHUNK_SIZE = 64 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# decompressed bytes per input byte at most (128 KiB RLE block from 4 bytes)
+ZSTD_MAX_RATIO = 32 * 1024
+ZSTD_MIN_SLICE = 64
+
+
+class CompressionError(ValueError):
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def normalize_encoding(header: str) -> str:
+    encoding = header.strip().lower()
+    if encoding in ('', 'none'):
+        return ENCODING_IDENTITY
+    if encoding == 'x-gzip':
+        return ENCODING_GZIP
+    return encoding
+
+
+class _CappedBuffer:
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.parts = []  # type: list[bytes]
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if 0 < self.max_size < self.size:
+            raise CompressionError(413, f'Decompressed body exceeds {self.max_size} bytes')
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def getvalue(self) -> bytes:
+        return b''.join(self.parts)
+
+
+async def _read_gzip(stream: AsyncIterator[bytes], buffer: _CappedBuffer):
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in stream:
+        data = chunk
+        while data:
+            buffer.write(decompressor.decompress(data, CHUNK_SIZE))
+            data = decompressor.unconsumed_tail
+        if decompressor.eof:
+            break
+    buffer.write(decompressor.flush())
+    if not decompressor.eof:
+        raise CompressionError(400, 'Truncated gzip body')
+
+
+def _zstd_slice(buffer: _CappedBuffer) -> int:
+    # input fed at once so that the output stays within the size limit
+    if buffer.max_size <= 0:
+        return CHUNK_SIZE
+    remaining = max(buffer.max_size - buffer.size, 0)
+    return min(max(remaining // ZSTD_MAX_RATIO, ZSTD_MIN_SLICE), CHUNK_SIZE)
+
+
+async def _read_zstd(stream: AsyncIterator[bytes], buffer: _CappedBuffer):
+    decompressor = zstandard.ZstdDecompressor().decompressobj(write_size=CHUNK_SIZE)
+    async for chunk in stream:
+        data = memoryview(chunk)
+        while len(data) > 0 and not decompressor.eof:
+            size = _zstd_slice(buffer)
+            buffer.write(decompressor.decompress(data[:size]))
+            data = data[size:]
+        if decompressor.eof:
+            break
+    if not decompressor.eof:
+        raise CompressionError(400, 'Truncated zstd body')
+
+
+async def read_body(stream: AsyncIterator[bytes], encoding: str, max_size: int) -> bytes:
+    """Reads (and decompresses) request body, size of the result is capped"""
+    buffer = _CappedBuffer(max_size=max_size)
+    encoding = normalize_encoding(encoding)
+    if encoding not in SUPPORTED_ENCODINGS:
+        raise CompressionError(415, f'Unsupported content-encoding: {encoding}')
+    try:
+        if encoding == ENCODING_GZIP:
+            await _read_gzip(stream, buffer)
+        elif encoding == ENCODING_ZSTD:
+            await _read_zstd(stream, buffer)
+        else:
+            async for chunk in stream:
+                buffer.write(chunk)
+    except (zlib.error, zstandard.ZstdError) as e:
+        raise CompressionError(400, f'Failed to decompress body ({encoding}): {str(e)}')
+    return buffer.getvalue()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == ENCODING_GZIP:
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    if encoding == ENCODING_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
@@ -1,8 +1,10 @@
+import hashlib
+import hmac
 import pathlib
 import random
 import yaml
 
-from typing import List, Optional
+from typing import Any, List, Optional
 
 
 class MissingConfigurationError(Exception):
@@ -16,7 +18,8 @@ class NanopubConfig:
     def __init__(self, servers: List[str], client_exec: str,
                  strategy: str, strategy_number: int, uri_replace: str,
                  client_timeout: int, workdir: str, sign_key_type: str,
-                 sign_nanopub: bool, sign_private_key: Optional[str]):
+                 sign_nanopub: bool, sign_private_key: Optional[str],
+                 warmup: bool, max_body_size: int, compression: dict[str, str]):
         self.servers = servers
         self.strategy = strategy.lower()
         self.strategy_number = strategy_number
@@ -27,6 +30,9 @@ class NanopubConfig:
         self.sign_private_key = sign_private_key
         self.workdir = pathlib.Path(workdir)
         self.uri_replace = uri_replace
+        self.warmup = warmup
+        self.max_body_size = max_body_size
+        self.compression = compression
 
     @property
     def target_servers(self) -> list[str]:
@@ -34,13 +40,16 @@ class NanopubConfig:
             return random.choices(self.servers, k=self.strategy_number)
         return self.servers
 
+    def server_compression(self, server: str) -> str:
+        return self.compression.get(server, 'identity')
+
 
 class TripleStoreConfig:
 
     def __init__(self, enabled: bool, sparql_endpoint: str, auth_method: str,
                  auth_username: str, auth_password: str, graph_class: str,
                  graph_named: str, graph_type: str, extra_queries: bool,
-                 strategy: str):
+                 strategy: str, compression: str, timeout: int):
         self.enabled = enabled
         self.sparql_endpoint = sparql_endpoint
         self.auth_method = auth_method
@@ -51,20 +60,58 @@ class TripleStoreConfig:
         self.graph_type = graph_type
         self.extra_queries = extra_queries
         self.strategy = strategy
+        self.compression = compression.lower()
+        self.timeout = timeout
+
+
+class RateLimitConfig:
+
+    def __init__(self, rate: float, burst: int, concurrency: int):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
 
 
 class SecurityConfig:
 
-    def __init__(self, enabled: bool, tokens: List[str]):
+    def __init__(self, enabled: bool, tokens: dict[str, RateLimitConfig],
+                 admin_tokens: set[str], limits_enabled: bool,
+                 limits: RateLimitConfig, workers: int):
         self.enabled = enabled
         self.tokens = tokens
+        self.admin_tokens = admin_tokens
+        self.limits_enabled = limits_enabled
+        self.limits = limits
+        self.workers = workers
+
+    @staticmethod
+    def hash_token(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def match_token(self, token: str) -> Optional[str]:
+        # compare against all known hashes to keep the timing independent
+        token_hash = self.hash_token(token)
+        match = None
+        for known_hash in self.tokens.keys():
+            if hmac.compare_digest(known_hash, token_hash):
+                match = known_hash
+        return match
+
+    def is_admin(self, token_hash: Optional[str]) -> bool:
+        return token_hash is not None and token_hash in self.admin_tokens
+
+    def token_limits(self, token_hash: str) -> RateLimitConfig:
+        return self.tokens.get(token_hash, self.limits)
 
 
 class LoggingConfig:
 
-    def __init__(self, level, message_format: str):
+    def __init__(self, level, message_format: str, output: str,
+                 debug_sampling: float):
         self.level = level
         self.format = message_format
+        self.output = output.lower()
+        self.debug_sampling = debug_sampling
 
 
 class MailConfig:
@@ -84,16 +131,132 @@ class MailConfig:
         self.recipients = recipients
 
 
+class TracingConfig:
+
+    def __init__(self, enabled: bool, exporter: str, file: str,
+                 endpoint: str, timeout: int, service_name: str):
+        self.enabled = enabled
+        self.exporter = exporter.lower()
+        self.file = file
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.service_name = service_name
+
+
+class ProfilingConfig:
+
+    def __init__(self, enabled: bool, directory: str, max_seconds: int):
+        self.enabled = enabled
+        self.directory = directory
+        self.max_seconds = max_seconds
+
+
+class ValidationConfig:
+
+    def __init__(self, enabled: bool, max_nanopubs: int, max_triples: int):
+        self.enabled = enabled
+        self.max_nanopubs = max_nanopubs
+        self.max_triples = max_triples
+
+
+class OutboxConfig:
+
+    def __init__(self, enabled: bool, path: str, workers: int,
+                 publish_first: bool, max_attempts: int, backoff: float,
+                 max_backoff: float, lease: float):
+        self.enabled = enabled
+        self.path = path
+        self.workers = workers
+        self.publish_first = publish_first
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+
+
+class CacheConfig:
+
+    def __init__(self, enabled: bool, max_size: int, spill_directory: str,
+                 spill_max_size: int, read_through: bool, timeout: int):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.spill_directory = spill_directory
+        self.spill_max_size = spill_max_size
+        self.read_through = read_through
+        self.timeout = timeout
+
+
+class CaptureConfig:
+
+    def __init__(self, enabled: bool, file: str, max_body_size: int):
+        self.enabled = enabled
+        self.file = file
+        self.max_body_size = max_body_size
+
+
+class OffloadConfig:
+
+    def __init__(self, enabled: bool, workers: int, min_size: int):
+        self.enabled = enabled
+        self.workers = workers
+        self.min_size = min_size
+
+
+class DedupConfig:
+
+    def __init__(self, enabled: bool, method: str, timeout: int, cache_size: int):
+        self.enabled = enabled
+        self.method = method
+        self.timeout = timeout
+        self.cache_size = cache_size
+
+
+class LaneConfig:
+
+    def __init__(self, name: str, max_size: int, max_nanopubs: int,
+                 workers: int, concurrency: int, timeout_factor: float):
+        self.name = name
+        self.max_size = max_size
+        self.max_nanopubs = max_nanopubs
+        self.workers = workers
+        self.concurrency = concurrency
+        self.timeout_factor = timeout_factor
+
+    def fits(self, size: int, nanopubs: int) -> bool:
+        return (self.max_size <= 0 or size <= self.max_size) and \
+            (self.max_nanopubs <= 0 or nanopubs <= self.max_nanopubs)
+
+
+class SchedulingConfig:
+
+    def __init__(self, enabled: bool, lanes: list[LaneConfig]):
+        self.enabled = enabled
+        self.lanes = lanes
+
+
 class SubmitterConfig:
 
     def __init__(self, nanopub: NanopubConfig, security: SecurityConfig,
                  triple_store: TripleStoreConfig, logging: LoggingConfig,
-                 mail: MailConfig):
+                 mail: MailConfig, tracing: TracingConfig,
+                 profiling: ProfilingConfig, validation: ValidationConfig,
+                 outbox: OutboxConfig, cache: CacheConfig,
+                 capture: CaptureConfig, offload: OffloadConfig,
+                 dedup: DedupConfig, scheduling: SchedulingConfig):
         self.nanopub = nanopub
         self.security = security
         self.triple_store = triple_store
         self.logging = logging
         self.mail = mail
+        self.tracing = tracing
+        self.profiling = profiling
+        self.validation = validation
+        self.outbox = outbox
+        self.cache = cache
+        self.capture = capture
+        self.offload = offload
+        self.dedup = dedup
+        self.scheduling = scheduling
 
 
 class SubmitterConfigParser:
@@ -110,6 +273,9 @@ class SubmitterConfigParser:
             'sign_private_key': '',
             'workdir': '/app/workdir',
             'uri_replace': None,
+            'warmup': True,
+            'max_body_size': 64 * 1024 * 1024,
+            'compression': {},
         },
         'triple_store': {
             'enabled': False,
@@ -126,14 +292,26 @@ class SubmitterConfigParser:
             },
             'extra_queries': False,
             'strategy': 'basic',
+            'compression': 'identity',
+            'timeout': 60,
         },
         'security': {
             'enabled': False,
             'tokens': [],
+            'admin_tokens': [],
+            'limits': {
+                'enabled': False,
+                'rate': 1.0,
+                'burst': 10,
+                'concurrency': 2,
+            },
+            'workers': 0,
         },
         'logging': {
             'level': 'INFO',
             'format': '%(asctime)s | %(levelname)s | %(module)s: %(message)s',
+            'output': 'text',
+            'debug_sampling': 1.0,
         },
         'mail': {
             'enabled': False,
@@ -147,6 +325,74 @@ class SubmitterConfigParser:
             'password': '',
             'recipients': [],
         },
+        'tracing': {
+            'enabled': False,
+            'exporter': 'file',
+            'file': '/app/workdir/traces.jsonl',
+            'endpoint': 'http://localhost:4318/v1/traces',
+            'timeout': 5,
+            'service_name': 'nanopub-submitter',
+        },
+        'profiling': {
+            'enabled': False,
+            'directory': '/app/workdir/profiles',
+            'max_seconds': 60,
+        },
+        'validation': {
+            'enabled': True,
+            'max_nanopubs': 0,
+            'max_triples': 0,
+        },
+        'outbox': {
+            'enabled': False,
+            'path': '',
+            'workers': 2,
+            'publish_first': True,
+            'max_attempts': 10,
+            'backoff': 5,
+            'max_backoff': 600,
+            'lease': 600,
+        },
+        'cache': {
+            'enabled': False,
+            'max_size': 64 * 1024 * 1024,
+            'spill_directory': '',
+            'spill_max_size': 1024 * 1024 * 1024,
+            'read_through': True,
+            'timeout': 5,
+        },
+        'capture': {
+            'enabled': False,
+            'file': '/app/workdir/capture.jsonl',
+            'max_body_size': 10 * 1024 * 1024,
+        },
+        'offload': {
+            'enabled': False,
+            'workers': 0,
+            'min_size': 256 * 1024,
+        },
+        'dedup': {
+            'enabled': False,
+            'method': 'HEAD',
+            'timeout': 2,
+            'cache_size': 10000,
+        },
+        'scheduling': {
+            'enabled': False,
+            'lanes': [
+                {
+                    'name': 'small',
+                    'max_size': 1024 * 1024,
+                    'max_nanopubs': 10,
+                    'workers': 4,
+                },
+                {
+                    'name': 'large',
+                    'workers': 1,
+                    'timeout_factor': 5.0,
+                },
+            ],
+        },
     }
 
     REQUIRED = []  # type: List[List[str]]
@@ -197,13 +443,50 @@ class SubmitterConfigParser:
             sign_private_key=self.get_or_default('nanopub', 'sign_private_key'),
             workdir=self.get_or_default('nanopub', 'workdir'),
             uri_replace=self.get_or_default('nanopub', 'uri_replace'),
+            warmup=self.get_or_default('nanopub', 'warmup'),
+            max_body_size=int(self.get_or_default('nanopub', 'max_body_size')),
+            compression={
+                str(server): str(encoding).lower()
+                for server, encoding in
+                (self.get_or_default('nanopub', 'compression') or {}).items()
+            },
+        )
+
+    def _token_limits(self, token: Any, defaults: RateLimitConfig) -> RateLimitConfig:
+        if not isinstance(token, dict):
+            return defaults
+        return RateLimitConfig(
+            rate=float(token.get('rate', defaults.rate)),
+            burst=int(token.get('burst', defaults.burst)),
+            concurrency=int(token.get('concurrency', defaults.concurrency)),
         )
 
     @property
     def _security(self):
+        limits = RateLimitConfig(
+            rate=float(self.get_or_default('security', 'limits', 'rate')),
+            burst=int(self.get_or_default('security', 'limits', 'burst')),
+            concurrency=int(self.get_or_default('security', 'limits', 'concurrency')),
+        )
+        tokens = dict()  # type: dict[str, RateLimitConfig]
+        for token in self.get_or_default('security', 'tokens') or []:
+            value = token.get('token', '') if isinstance(token, dict) else token
+            if not value:
+                continue
+            token_hash = SecurityConfig.hash_token(str(value))
+            tokens[token_hash] = self._token_limits(token, limits)
+        admin_tokens = set()  # type: set[str]
+        for token in self.get_or_default('security', 'admin_tokens') or []:
+            token_hash = SecurityConfig.hash_token(str(token))
+            tokens.setdefault(token_hash, limits)
+            admin_tokens.add(token_hash)
         return SecurityConfig(
             enabled=self.get_or_default('security', 'enabled'),
-            tokens=self.get_or_default('security', 'tokens'),
+            tokens=tokens,
+            admin_tokens=admin_tokens,
+            limits_enabled=self.get_or_default('security', 'limits', 'enabled'),
+            limits=limits,
+            workers=int(self.get_or_default('security', 'workers')),
         )
 
     @property
@@ -211,6 +494,8 @@ class SubmitterConfigParser:
         return LoggingConfig(
             level=self.get_or_default('logging', 'level'),
             message_format=self.get_or_default('logging', 'format'),
+            output=self.get_or_default('logging', 'output'),
+            debug_sampling=float(self.get_or_default('logging', 'debug_sampling')),
         )
 
     @property
@@ -226,6 +511,8 @@ class SubmitterConfigParser:
             graph_type=self.get_or_default('triple_store', 'graph', 'type'),
             extra_queries=self.get_or_default('triple_store', 'extra_queries'),
             strategy=self.get_or_default('triple_store', 'strategy'),
+            compression=self.get_or_default('triple_store', 'compression'),
+            timeout=self.get_or_default('triple_store', 'timeout'),
         )
 
     @property
@@ -243,6 +530,102 @@ class SubmitterConfigParser:
             recipients=self.get_or_default('mail', 'recipients'),
         )
 
+    @property
+    def _tracing(self):
+        return TracingConfig(
+            enabled=self.get_or_default('tracing', 'enabled'),
+            exporter=self.get_or_default('tracing', 'exporter'),
+            file=self.get_or_default('tracing', 'file'),
+            endpoint=self.get_or_default('tracing', 'endpoint'),
+            timeout=self.get_or_default('tracing', 'timeout'),
+            service_name=self.get_or_default('tracing', 'service_name'),
+        )
+
+    @property
+    def _profiling(self):
+        return ProfilingConfig(
+            enabled=self.get_or_default('profiling', 'enabled'),
+            directory=self.get_or_default('profiling', 'directory'),
+            max_seconds=self.get_or_default('profiling', 'max_seconds'),
+        )
+
+    @property
+    def _validation(self):
+        return ValidationConfig(
+            enabled=self.get_or_default('validation', 'enabled'),
+            max_nanopubs=self.get_or_default('validation', 'max_nanopubs'),
+            max_triples=self.get_or_default('validation', 'max_triples'),
+        )
+
+    @property
+    def _outbox(self):
+        return OutboxConfig(
+            enabled=self.get_or_default('outbox', 'enabled'),
+            path=self.get_or_default('outbox', 'path'),
+            workers=int(self.get_or_default('outbox', 'workers')),
+            publish_first=self.get_or_default('outbox', 'publish_first'),
+            max_attempts=int(self.get_or_default('outbox', 'max_attempts')),
+            backoff=float(self.get_or_default('outbox', 'backoff')),
+            max_backoff=float(self.get_or_default('outbox', 'max_backoff')),
+            lease=float(self.get_or_default('outbox', 'lease')),
+        )
+
+    @property
+    def _cache(self):
+        return CacheConfig(
+            enabled=self.get_or_default('cache', 'enabled'),
+            max_size=int(self.get_or_default('cache', 'max_size')),
+            spill_directory=self.get_or_default('cache', 'spill_directory'),
+            spill_max_size=int(self.get_or_default('cache', 'spill_max_size')),
+            read_through=self.get_or_default('cache', 'read_through'),
+            timeout=self.get_or_default('cache', 'timeout'),
+        )
+
+    @property
+    def _capture(self):
+        return CaptureConfig(
+            enabled=self.get_or_default('capture', 'enabled'),
+            file=self.get_or_default('capture', 'file'),
+            max_body_size=int(self.get_or_default('capture', 'max_body_size')),
+        )
+
+    @property
+    def _offload(self):
+        return OffloadConfig(
+            enabled=self.get_or_default('offload', 'enabled'),
+            workers=int(self.get_or_default('offload', 'workers')),
+            min_size=int(self.get_or_default('offload', 'min_size')),
+        )
+
+    @property
+    def _dedup(self):
+        return DedupConfig(
+            enabled=self.get_or_default('dedup', 'enabled'),
+            method=str(self.get_or_default('dedup', 'method')).upper(),
+            timeout=self.get_or_default('dedup', 'timeout'),
+            cache_size=int(self.get_or_default('dedup', 'cache_size')),
+        )
+
+    def _lane(self, index: int, lane: Any) -> LaneConfig:
+        if not isinstance(lane, dict):
+            lane = dict()
+        return LaneConfig(
+            name=str(lane.get('name', f'lane{index}')),
+            max_size=int(lane.get('max_size', 0)),
+            max_nanopubs=int(lane.get('max_nanopubs', 0)),
+            workers=int(lane.get('workers', 0)),
+            concurrency=int(lane.get('concurrency', 0)),
+            timeout_factor=float(lane.get('timeout_factor', 1.0)),
+        )
+
+    @property
+    def _scheduling(self):
+        lanes = self.get_or_default('scheduling', 'lanes') or []
+        return SchedulingConfig(
+            enabled=self.get_or_default('scheduling', 'enabled'),
+            lanes=[self._lane(i, lane) for i, lane in enumerate(lanes)],
+        )
+
     def parse_file(self, fp) -> SubmitterConfig:
         self.cfg = yaml.full_load(fp)
         self.validate()
@@ -256,6 +639,15 @@ class SubmitterConfigParser:
             logging=self._logging,
             triple_store=self._triple_store,
             mail=self._mail,
+            tracing=self._tracing,
+            profiling=self._profiling,
+            validation=self._validation,
+            outbox=self._outbox,
+            cache=self._cache,
+            capture=self._capture,
+            offload=self._offload,
+            dedup=self._dedup,
+            scheduling=self._scheduling,
         )
 
 
@@ -264,6 +656,8 @@ cfg_parser = SubmitterConfigParser()
 
 class RequestConfig:
 
-    def __init__(self, servers: list[str], uri_replace: Optional[str]):
+    def __init__(self, servers: list[str], uri_replace: Optional[str],
+                 timeout_factor: float = 1.0):
         self.servers = servers
         self.uri_replace = uri_replace
+        self.timeout_factor = timeout_factor
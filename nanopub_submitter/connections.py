@@ -0,0 +1,45 @@
+import requests
+import requests.adapters
+import threading
+
+from typing import Optional  # noqa: F401
+
+from nanopub_submitter.consts import PACKAGE_NAME, PACKAGE_VERSION
+from nanopub_submitter.logger import LOG
+
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 32
+
+_SESSION = None  # type: Optional[requests.Session]
+_LOCK = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Shared session keeping connections to outbound services alive"""
+    global _SESSION
+    if _SESSION is None:
+        with _LOCK:
+            if _SESSION is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = f'{PACKAGE_NAME}/{PACKAGE_VERSION}'
+                _SESSION = session
+    return _SESSION
+
+
+def prewarm(urls: list[str], timeout: int) -> int:
+    """Opens connections to given URLs, returns number of reachable ones"""
+    session = get_session()
+    reachable = 0
+    for url in urls:
+        try:
+            session.head(url=url, timeout=timeout)
+            reachable += 1
+        except Exception as e:
+            LOG.warning('Failed to pre-warm connection to %s: %s', url, e)
+    return reachable
@@ -14,10 +14,56 @@ COMMENT_PRE_QUERY_PREFIX = '#> pre-query:'
 COMMENT_POST_QUERY_PREFIX = '#> post-query:'
 
 DEFAULT_ENCODING = 'utf-8'
+
+FORMAT_TRIG = 'trig'
+FORMAT_NQUADS = 'nquads'
+FORMAT_JSONLD = 'json-ld'
+INPUT_FORMATS = {
+    'application/trig': FORMAT_TRIG,
+    'application/n-quads': FORMAT_NQUADS,
+    'application/ld+json': FORMAT_JSONLD,
+}
+FORMAT_MEDIA_TYPES = {
+    FORMAT_TRIG: 'application/trig',
+    FORMAT_NQUADS: 'application/n-quads',
+    FORMAT_JSONLD: 'application/ld+json',
+}
+FORMAT_EXTENSIONS = {
+    FORMAT_TRIG: 'trig',
+    FORMAT_NQUADS: 'nq',
+    FORMAT_JSONLD: 'jsonld',
+}
 DEFAULT_CONFIG = '/app/config.yml'
 DEFAULT_LOG_LEVEL = 'INFO'
 DEFAULT_LOG_FORMAT = '%(asctime)s | %(levelname)s | %(module)s: %(message)s'
 
+WARMUP_NANOPUB = """@prefix this: <http://purl.org/nanopub/temp/warmup> .
+@prefix sub: <http://purl.org/nanopub/temp/warmup#> .
+@prefix np: <http://www.nanopub.org/nschema#> .
+@prefix dct: <http://purl.org/dc/terms/> .
+@prefix prov: <http://www.w3.org/ns/prov#> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+
+sub:Head {
+  this: a np:Nanopublication ;
+    np:hasAssertion sub:assertion ;
+    np:hasProvenance sub:provenance ;
+    np:hasPublicationInfo sub:pubinfo .
+}
+
+sub:assertion {
+  sub:warmup a <https://w3id.org/dsw/nanopub/Warmup> .
+}
+
+sub:provenance {
+  sub:assertion prov:wasAttributedTo <https://ds-wizard.org> .
+}
+
+sub:pubinfo {
+  this: dct:created "2024-01-01T00:00:00Z"^^xsd:dateTime .
+}
+"""
+
 
 BUILD_INFO = {
     'name': NICE_NAME,
@@ -0,0 +1,85 @@
+import collections
+import threading
+
+from nanopub_submitter.config import SubmitterConfig
+from nanopub_submitter.connections import get_session
+from nanopub_submitter.logger import LOG
+
+# servers not supporting HEAD
+FALLBACK_STATUSES = (405, 501)
+
+
+def nanopub_url(server: str, code: str) -> str:
+    return f'{server.rstrip("/")}/{code}.trig'
+
+
+class ExistenceChecker:
+    """Checks if a server already has a nanopub (by artifact code)"""
+    _instance = None
+
+    def __init__(self):
+        self.cfg = None
+        self.lock = threading.Lock()
+        # only hits are remembered, trusty nanopubs never change
+        self.known = collections.OrderedDict()  # type: collections.OrderedDict[tuple, bool]
+
+    @classmethod
+    def init(cls, config: SubmitterConfig):
+        instance = cls.get()
+        with instance.lock:
+            instance.cfg = config
+            instance.known.clear()
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = ExistenceChecker()
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.cfg is not None and self.cfg.dedup.enabled
+
+    def _known(self, server: str, code: str) -> bool:
+        key = (server, code)
+        with self.lock:
+            if key not in self.known:
+                return False
+            self.known.move_to_end(key)
+            return True
+
+    def mark(self, server: str, code: str):
+        """Remembers that server has the nanopub (e.g. after publishing)"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.known[(server, code)] = True
+            self.known.move_to_end((server, code))
+            while len(self.known) > max(self.cfg.dedup.cache_size, 0):
+                self.known.popitem(last=False)
+
+    def _request(self, url: str) -> int:
+        session = get_session()
+        timeout = self.cfg.dedup.timeout
+        if self.cfg.dedup.method == 'HEAD':
+            r = session.head(url=url, timeout=timeout, allow_redirects=True)
+            if r.status_code not in FALLBACK_STATUSES:
+                return r.status_code
+        with session.get(url=url, timeout=timeout, stream=True) as r:
+            return r.status_code
+
+    def exists(self, server: str, code: str) -> bool:
+        if not self.enabled:
+            return False
+        if self._known(server, code):
+            return True
+        url = nanopub_url(server, code)
+        try:
+            status = self._request(url)
+        except Exception as e:
+            LOG.debug('Failed to check nanopub %s: %s', url, e)
+            return False
+        if status != 200:
+            return False
+        self.mark(server, code)
+        return True
@@ -0,0 +1,108 @@
+import importlib
+import threading
+import time
+
+from nanopub_submitter.config import SubmitterConfig
+from nanopub_submitter.connections import prewarm
+from nanopub_submitter.logger import LOG
+from nanopub_submitter.nanopub import warm_up
+
+HEAVY_MODULES = ('rdflib', 'SPARQLWrapper')
+# failed warm-up is retried (doubled delay up to max) until ready
+WARMUP_BACKOFF = 5.0
+WARMUP_MAX_BACKOFF = 300.0
+
+
+class Health:
+    _instance = None
+
+    def __init__(self):
+        self.cfg = None
+        self.config_loaded = False
+        self.modules_loaded = False
+        self.np_ready = False
+        self.connections_ready = False
+        self.warmup_done = False
+        self.warmup_attempts = 0
+        self.started_at = time.monotonic()
+
+    @classmethod
+    def init(cls, config: SubmitterConfig, config_loaded: bool):
+        instance = cls.get()
+        instance.cfg = config
+        instance.config_loaded = config_loaded
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = Health()
+        return cls._instance
+
+    def start_warmup(self):
+        thread = threading.Thread(
+            target=self._warmup,
+            name='warmup',
+            daemon=True,
+        )
+        thread.start()
+
+    def _warmup(self):
+        delay = WARMUP_BACKOFF
+        while True:
+            self._warmup_attempt()
+            if self.modules_loaded and self.np_ready:
+                return
+            LOG.warning('Warm-up not ready, retrying in %.1fs (attempt %d)',
+                        delay, self.warmup_attempts)
+            time.sleep(delay)
+            delay = min(delay * 2, WARMUP_MAX_BACKOFF)
+
+    def _warmup_attempt(self):
+        start = time.monotonic()
+        self.warmup_attempts += 1
+        if not self.modules_loaded:
+            try:
+                for module in HEAVY_MODULES:
+                    importlib.import_module(module)
+                self.modules_loaded = True
+            except Exception as e:
+                LOG.error('Failed to import modules: %s', e)
+        if self.cfg.nanopub.warmup:
+            if not self.connections_ready:
+                self.connections_ready = prewarm(
+                    urls=self.cfg.nanopub.servers,
+                    timeout=self.cfg.nanopub.client_timeout,
+                ) > 0
+            if not self.np_ready:
+                self.np_ready = warm_up(cfg=self.cfg)
+        else:
+            self.connections_ready = True
+            self.np_ready = True
+        self.warmup_done = True
+        LOG.info('Warm-up finished in %.2fs (np client ready: %s)',
+                 time.monotonic() - start, self.np_ready)
+
+    @property
+    def live(self) -> dict:
+        return {
+            'status': 'UP',
+            'uptime': round(time.monotonic() - self.started_at, 3),
+        }
+
+    @property
+    def ready(self) -> bool:
+        return self.config_loaded and self.modules_loaded and self.np_ready
+
+    @property
+    def readiness(self) -> dict:
+        return {
+            'status': 'UP' if self.ready else 'DOWN',
+            'checks': {
+                'config': self.config_loaded,
+                'modules': self.modules_loaded,
+                'npClient': self.np_ready,
+                'connections': self.connections_ready,
+                'warmupDone': self.warmup_done,
+                'warmupAttempts': self.warmup_attempts,
+            },
+        }
@@ -0,0 +1,227 @@
+import asyncio
+import collections
+import contextlib
+import time
+
+from typing import AsyncIterator, Optional
+
+from nanopub_submitter.config import SubmitterConfig, RateLimitConfig, LaneConfig
+from nanopub_submitter.logger import LOG
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token, returns 0 if allowed or seconds until next token"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        if self.rate <= 0:
+            return True
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class FairScheduler:
+    """Shares worker slots among tenants in round-robin fashion"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.active = 0
+        self.queues = collections.OrderedDict()  # type: collections.OrderedDict
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def _dequeue(self, tenant: str, future: asyncio.Future):
+        queue = self.queues.get(tenant, None)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if len(queue) == 0:
+            del self.queues[tenant]
+
+    async def acquire(self, tenant: str):
+        if self.workers <= 0:
+            return
+        if self.active < self.workers and len(self.queues) == 0:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(tenant, collections.deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # slot was handed over before cancellation
+                self.release()
+            else:
+                self._dequeue(tenant, future)
+            raise
+
+    def release(self):
+        if self.workers <= 0:
+            return
+        while len(self.queues) > 0:
+            tenant, queue = self.queues.popitem(last=False)
+            future = queue.popleft()
+            if len(queue) > 0:
+                # tenant goes to the end of the line
+                self.queues[tenant] = queue
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, tenant: str) -> AsyncIterator[None]:
+        await self.acquire(tenant)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class TenantState:
+
+    def __init__(self, limits: RateLimitConfig):
+        self.limits = limits
+        self.bucket = TokenBucket(rate=limits.rate, burst=limits.burst)
+        self.in_flight = 0
+
+    def idle(self, now: float) -> bool:
+        # nothing running or queued and dropping it loses no state
+        return self.in_flight == 0 and self.bucket.full(now)
+
+
+class Lane:
+    """Submissions of similar size with own worker slots and limits"""
+
+    def __init__(self, config: LaneConfig):
+        self.config = config
+        self.scheduler = FairScheduler(workers=config.workers)
+        self.in_flight = collections.Counter()  # type: collections.Counter[str]
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+
+class SubmissionLimiter:
+    _instance = None
+
+    CONCURRENCY_RETRY_AFTER = 1.0
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self):
+        self.cfg = None
+        self.tenants = dict()  # type: dict[str, TenantState]
+        self.swept = time.monotonic()
+        self.scheduler = FairScheduler(workers=0)
+        self.lanes = []  # type: list[Lane]
+
+    @classmethod
+    def init(cls, config: SubmitterConfig):
+        instance = cls.get()
+        instance.cfg = config
+        instance.tenants.clear()
+        instance.swept = time.monotonic()
+        instance.scheduler = FairScheduler(workers=config.security.workers)
+        instance.lanes = [Lane(lane) for lane in config.scheduling.lanes] \
+            if config.scheduling.enabled else []
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = SubmissionLimiter()
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.cfg is not None and self.cfg.security.limits_enabled
+
+    def _tenant(self, tenant: str) -> TenantState:
+        if tenant not in self.tenants:
+            limits = self.cfg.security.token_limits(tenant)
+            self.tenants[tenant] = TenantState(limits=limits)
+        return self.tenants[tenant]
+
+    def _sweep(self):
+        # tenants are client hosts without security, forget idle ones
+        now = time.monotonic()
+        if now - self.swept < self.SWEEP_INTERVAL:
+            return
+        self.swept = now
+        for tenant in [t for t, state in self.tenants.items() if state.idle(now)]:
+            del self.tenants[tenant]
+
+    def admit(self, tenant: str) -> Optional[float]:
+        """Admits request of tenant, returns Retry-After seconds if rejected"""
+        if not self.enabled:
+            return None
+        self._sweep()
+        state = self._tenant(tenant)
+        if 0 < state.limits.concurrency <= state.in_flight:
+            LOG.debug('Tenant %s reached concurrency limit', tenant[:8])
+            return self.CONCURRENCY_RETRY_AFTER
+        retry_after = state.bucket.take()
+        if retry_after > 0:
+            LOG.debug('Tenant %s reached rate limit', tenant[:8])
+            return retry_after
+        state.in_flight += 1
+        return None
+
+    def finish(self, tenant: str):
+        if not self.enabled:
+            return
+        state = self._tenant(tenant)
+        state.in_flight = max(state.in_flight - 1, 0)
+
+    def lane(self, size: int, nanopubs: int) -> Optional[Lane]:
+        """First lane the submission fits in (the last one takes the rest)"""
+        if len(self.lanes) == 0:
+            return None
+        for lane in self.lanes:
+            if lane.config.fits(size=size, nanopubs=nanopubs):
+                return lane
+        return self.lanes[-1]
+
+    def admit_lane(self, tenant: str, lane: Optional[Lane]) -> Optional[float]:
+        """Admits request of tenant to lane, returns Retry-After seconds if rejected"""
+        if lane is None:
+            return None
+        if 0 < lane.config.concurrency <= lane.in_flight[tenant]:
+            LOG.debug('Tenant %s reached concurrency limit of lane %s', tenant[:8], lane.name)
+            return self.CONCURRENCY_RETRY_AFTER
+        lane.in_flight[tenant] += 1
+        return None
+
+    def finish_lane(self, tenant: str, lane: Optional[Lane]):
+        if lane is None:
+            return
+        lane.in_flight[tenant] -= 1
+        if lane.in_flight[tenant] <= 0:
+            del lane.in_flight[tenant]
+
+    def slot(self, tenant: str, lane: Optional[Lane] = None):
+        # lanes have own slots, so small submissions do not wait for large ones
+        if lane is not None:
+            return lane.scheduler.slot(tenant)
+        return self.scheduler.slot(tenant)
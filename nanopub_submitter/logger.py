@@ -1,26 +1,135 @@
+import atexit
+import copy
+import datetime
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
+import zlib
+
+from typing import Optional  # noqa: F401
 
 from nanopub_submitter.consts import LOGGER_NAME, DEFAULT_LOG_FORMAT, DEFAULT_LOG_LEVEL
 from nanopub_submitter.config import SubmitterConfig
 
 LOG = logging.getLogger(LOGGER_NAME)
 
+_LISTENER = None  # type: Optional[logging.handlers.QueueListener]
+
+
+class SubmissionLogAdapter(logging.LoggerAdapter):
+    """Attaches submission ID to the records as a structured field"""
+
+    def __init__(self, submission_id: str):
+        super().__init__(LOG, {'submission_id': submission_id})
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**kwargs.get('extra', {}), **self.extra}
+        return msg, kwargs
+
+
+class TextFormatter(logging.Formatter):
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        submission_id = getattr(record, 'submission_id', None)
+        if submission_id is not None:
+            record.message = f'[ID:{submission_id}] {record.message}'
+        return super().formatMessage(record)
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'timestamp': datetime.datetime.fromtimestamp(
+                record.created, tz=datetime.timezone.utc,
+            ).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        submission_id = getattr(record, 'submission_id', None)
+        if submission_id is not None:
+            entry['submission_id'] = submission_id
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keeps only a fraction of DEBUG records (whole submissions together)"""
+
+    SCALE = 10000
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.threshold = int(max(0.0, min(rate, 1.0)) * self.SCALE)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.threshold >= self.SCALE:
+            return True
+        submission_id = getattr(record, 'submission_id', None)
+        if submission_id is None:
+            return random.randrange(self.SCALE) < self.threshold
+        return zlib.crc32(submission_id.encode('utf-8')) % self.SCALE < self.threshold
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records as they are, formatting happens in the listener"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+
+def _stop_listener():
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        _LISTENER = None
+
+
+def _init_logging(level, message_format: str, output: str = 'text',
+                  debug_sampling: float = 1.0):
+    global _LISTENER
+    _stop_listener()
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+
+    stream_handler = logging.StreamHandler(stream=sys.stdout)
+    if output == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter(fmt=message_format))
+
+    log_queue = queue.SimpleQueue()  # type: queue.SimpleQueue
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(rate=debug_sampling))
+
+    logging.root.addHandler(queue_handler)
+    logging.root.setLevel(level)
+    LOG.setLevel(level)
+
+    _LISTENER = logging.handlers.QueueListener(log_queue, stream_handler)
+    _LISTENER.start()
+
 
 def init_default_logging():
-    logging.basicConfig(
-        stream=sys.stdout,
+    _init_logging(
         level=DEFAULT_LOG_LEVEL,
-        format=DEFAULT_LOG_FORMAT,
+        message_format=DEFAULT_LOG_FORMAT,
     )
 
 
 def init_config_logging(config: SubmitterConfig):
-    for handler in logging.root.handlers[:]:
-        logging.root.removeHandler(handler)
-    LOG.setLevel(config.logging.level)
-    logging.basicConfig(
-        stream=sys.stdout,
+    _init_logging(
         level=config.logging.level,
-        format=config.logging.format,
+        message_format=config.logging.format,
+        output=config.logging.output,
+        debug_sampling=config.logging.debug_sampling,
     )
+
+
+atexit.register(_stop_listener)
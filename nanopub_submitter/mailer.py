@@ -31,15 +31,20 @@ class Mailer:
                f"{self.cfg.mail.name}\n"
 
     def notice(self, nanopub_uri: str):
+        try:
+            self.send_notice(nanopub_uri=nanopub_uri)
+        except Exception as e:
+            LOG.warning('Failed to send notification: %s', e)
+
+    def send_notice(self, nanopub_uri: str):
         if not self.cfg.mail.enabled:
-            LOG.debug(f'Notification for {nanopub_uri} skipped'
-                      f'(mail disabled)')
+            LOG.debug('Notification for %s skipped (mail disabled)', nanopub_uri)
             return
         if len(self.cfg.mail.recipients) < 1:
-            LOG.debug(f'Notification for {nanopub_uri} skipped'
-                      f'(no recipients defined)')
+            LOG.debug('Notification for %s skipped (no recipients defined)',
+                      nanopub_uri)
             return
-        LOG.info(f'Sending notification for {nanopub_uri}')
+        LOG.info('Sending notification for %s', nanopub_uri)
 
         msg = email.message.Message()
         msg['From'] = self.cfg.mail.email
@@ -47,11 +52,8 @@ class Mailer:
         msg['Subject'] = f'[{self.cfg.mail.name}] New nanopublication'
         msg.add_header('Content-Type', 'text/plain')
         msg.set_payload(self._msg_text(nanopub_uri))
-        try:
-            result = self._send(msg)
-            LOG.debug(f'Email result: {result}')
-        except Exception as e:
-            LOG.warn(f'Failed to send notification: {str(e)}')
+        result = self._send(msg)
+        LOG.debug('Email result: %s', result)
 
     def _send(self, message: email.message.Message):
         if self.cfg.mail.security == 'ssl':
@@ -1,13 +1,25 @@
-import rdflib  # type: ignore
-import requests
+import os
 import subprocess
 
 from typing import Optional, Tuple
 
+from nanopub_submitter.cache import NanopubCache, artifact_code
+from nanopub_submitter.compression import compress, normalize_encoding, ENCODING_IDENTITY
 from nanopub_submitter.config import SubmitterConfig, RequestConfig
-from nanopub_submitter.consts import DEFAULT_ENCODING, PACKAGE_NAME, PACKAGE_VERSION
-from nanopub_submitter.logger import LOG
-from nanopub_submitter.triple_store import store_to_triple_store
+from nanopub_submitter.connections import get_session
+from nanopub_submitter.consts import DEFAULT_ENCODING, WARMUP_NANOPUB, \
+    FORMAT_TRIG, FORMAT_NQUADS, FORMAT_EXTENSIONS
+from nanopub_submitter.dedup import ExistenceChecker
+from nanopub_submitter.logger import SubmissionLogAdapter
+from nanopub_submitter.outbox import Outbox, OutboxEntry, \
+    KIND_PUBLISH, KIND_TRIPLE_STORE, KIND_MAIL
+from nanopub_submitter.tracing import Trace, TRACEPARENT_HEADER
+from nanopub_submitter.triple_store import build_query, update_triple_store
+from nanopub_submitter.nquads import index_nquads
+from nanopub_submitter.offload import Offload
+from nanopub_submitter.quadstore import parse_rdf
+from nanopub_submitter.validation import StructureIndex, NanopubStats, \
+    NanopubValidationError, validate_index, count_this_prefixes
 
 EXIT_SUCCESS = 0
 
@@ -18,14 +30,26 @@ class NanopubProcessingError(RuntimeError):
         self.status_code = status_code
         self.message = message
 
+    def __reduce__(self):
+        # raised also in offload worker processes
+        return NanopubProcessingError, (self.status_code, self.message)
+
 
 class NanopubSubmissionResult:
 
     def __init__(self, location: Optional[str], servers: list[str],
-                 triple_store: Optional[bool]):
+                 triple_store: Optional[bool],
+                 queued: Optional[list[tuple[str, str]]] = None,
+                 nanopub: Optional[str] = None):
         self.location = location
         self.servers = servers
         self.triple_store = triple_store
+        self.queued = queued or []
+        self.nanopub = nanopub
+
+    @property
+    def mail_queued(self) -> bool:
+        return any(kind == KIND_MAIL for kind, _ in self.queued)
 
     def __str__(self):
         str = [f'Nanopublication URI: {self.location}']
@@ -35,17 +59,26 @@ class NanopubSubmissionResult:
             str.append(f'- {server}')
         if self.triple_store:
             str.append('\n+ Nanopublication has been stored to triple-store')
+        deliveries = [(k, t) for k, t in self.queued if k != KIND_MAIL]
+        if len(deliveries) > 0:
+            str.append('Queued for delivery:')
+        for kind, target in deliveries:
+            str.append(f'- {kind}: {target}')
         return '\n'.join(str)
 
 
 class NanopubProcessingContext:
 
     def __init__(self, submission_id: str, cfg: SubmitterConfig,
-                 req_cfg: RequestConfig):
+                 req_cfg: RequestConfig, trace: Optional[Trace] = None,
+                 input_format: str = FORMAT_TRIG):
         self.id = submission_id
+        self.input_format = input_format
         self.cfg = cfg
         self.req_cfg = req_cfg
         self.uri = None
+        self.log = SubmissionLogAdapter(submission_id=submission_id)
+        self.trace = trace or Trace(submission_id=submission_id, enabled=False)
 
     def cleanup(self):
         files = (self.input_file, self.trusty_file, self.signed_file)
@@ -70,9 +103,19 @@ class NanopubProcessingContext:
             return self.req_cfg.uri_replace
         return None
 
+    @property
+    def client_timeout(self) -> float:
+        # scaled by scheduling lane of the submission
+        return self.cfg.nanopub.client_timeout * self.req_cfg.timeout_factor
+
     @property
     def input_file(self) -> str:
-        return f'{self.id}.trig'
+        return f'{self.id}.{FORMAT_EXTENSIONS[self.input_format]}'
+
+    @property
+    def output_format(self) -> str:
+        # np client writes in format given by extension of output file
+        return FORMAT_TRIG
 
     @property
     def trusty_file(self) -> str:
@@ -82,21 +125,20 @@ class NanopubProcessingContext:
     def signed_file(self) -> str:
         return f'{self.id}.sign.trig'
 
-    @property
-    def _pre(self) -> str:
-        return f'[ID:{self.id}]'
+    def span(self, name: str, **attributes):
+        return self.trace.span(name, **attributes)
 
-    def debug(self, message: str):
-        LOG.debug(f'{self._pre} {message}')
+    def debug(self, message: str, *args):
+        self.log.debug(message, *args)
 
-    def info(self, message: str):
-        LOG.info(f'{self._pre} {message}')
+    def info(self, message: str, *args):
+        self.log.info(message, *args)
 
-    def warn(self, message: str):
-        LOG.warn(f'{self._pre} {message}')
+    def warn(self, message: str, *args):
+        self.log.warning(message, *args)
 
-    def error(self, message: str):
-        LOG.error(f'{self._pre} {message}')
+    def error(self, message: str, *args):
+        self.log.error(message, *args)
 
 
 def _split_nanopubs(nanopub_bundle: str) -> list[str]:
@@ -114,60 +156,124 @@ def _split_nanopubs(nanopub_bundle: str) -> list[str]:
 
 
 def _publish_nanopub(nanopub_bundle: str, ctx: NanopubProcessingContext) -> list[str]:
-    success = []
     nanopubs = _split_nanopubs(nanopub_bundle)
-    for server in ctx.target_servers:
-        ctx.debug(f'Submitting to: {server}')
-        ok = True
-        for nanopub in nanopubs:
-            try:
-                r = requests.post(
-                    url=server,
-                    data=nanopub.encode(encoding=DEFAULT_ENCODING),
-                    headers={
-                        'Content-Type': f'application/trig; charset={DEFAULT_ENCODING}',
-                        'User-Agent': f'{PACKAGE_NAME}/{PACKAGE_VERSION}',
-                    },
-                    timeout=10,
-                )
-                if not r.ok:
-                    ok = False
-                    ctx.warn(f'Failed to publish nanopub via {server}')
-                    ctx.debug(f'status={r.status_code}')
-                    ctx.debug(r.text)
-                    break
-            except Exception as e:
-                ok = False
-                ctx.warn(f'Failed to publish nanopub via {server}: {str(e)}')
-                break
-        if ok:
-            ctx.info(f'Nanopub published via {server}')
-            success.append(server)
-    return success
+    return [server for server in ctx.target_servers
+            if _publish_via(server=server, nanopubs=nanopubs, ctx=ctx)]
+
+
+def _publish_first(nanopub_bundle: str, servers: list[str],
+                   ctx: NanopubProcessingContext) -> Tuple[list[str], list[str]]:
+    # stops at first server accepting the nanopub, returns (published, remaining)
+    nanopubs = _split_nanopubs(nanopub_bundle)
+    for i, server in enumerate(servers):
+        if _publish_via(server=server, nanopubs=nanopubs, ctx=ctx):
+            return [server], servers[i + 1:]
+    return [], []
+
+
+def _publish_via(server: str, nanopubs: list[str], ctx: NanopubProcessingContext) -> bool:
+    ctx.debug('Submitting to: %s', server)
+    with ctx.span('publish', **{'server.url': server}) as span:
+        ok = _publish_to_server(server=server, nanopubs=nanopubs, ctx=ctx)
+        if span is not None and not ok:
+            span.fail('Failed to publish')
+    if ok:
+        ctx.info('Nanopub published via %s', server)
+    return ok
+
+
+def _nanopub_code(nanopub: str) -> Optional[str]:
+    uri = _extract_np_uri(nanopub)
+    return artifact_code(uri) if uri is not None else None
+
+
+def _already_published(server: str, code: Optional[str],
+                       ctx: NanopubProcessingContext) -> bool:
+    checker = ExistenceChecker.get()
+    if code is None or not checker.enabled:
+        return False
+    with ctx.span('dedup.check', **{'server.url': server}) as span:
+        exists = checker.exists(server, code)
+        if span is not None:
+            span.set('exists', exists)
+    if exists:
+        ctx.debug('Nanopub %s already on %s, skipping', code, server)
+    return exists
+
+
+def _publish_to_server(server: str, nanopubs: list[str],
+                       ctx: NanopubProcessingContext) -> bool:
+    for nanopub in nanopubs:
+        code = _nanopub_code(nanopub)
+        if _already_published(server=server, code=code, ctx=ctx):
+            continue
+        if not _post_nanopub(server=server, nanopub=nanopub, ctx=ctx):
+            return False
+        if code is not None:
+            ExistenceChecker.get().mark(server, code)
+    return True
+
+
+def _post_nanopub(server: str, nanopub: str, ctx: NanopubProcessingContext) -> bool:
+    encoding = normalize_encoding(ctx.cfg.nanopub.server_compression(server))
+    with ctx.span('http.post', **{'http.url': server}) as span:
+        try:
+            headers = {
+                'Content-Type': f'application/trig; charset={DEFAULT_ENCODING}',
+            }
+            traceparent = ctx.trace.traceparent
+            if traceparent is not None and ctx.trace.propagated:
+                headers[TRACEPARENT_HEADER] = traceparent
+            if encoding != ENCODING_IDENTITY:
+                headers['Content-Encoding'] = encoding
+            r = get_session().post(
+                url=server,
+                data=compress(nanopub.encode(encoding=DEFAULT_ENCODING), encoding),
+                headers=headers,
+                timeout=10,
+            )
+            if span is not None:
+                span.set('http.status_code', r.status_code)
+            if not r.ok:
+                ctx.warn('Failed to publish nanopub via %s', server)
+                ctx.debug('status=%s', r.status_code)
+                ctx.debug('%s', r.text)
+                if span is not None:
+                    span.fail(f'HTTP {r.status_code}')
+                return False
+        except Exception as e:
+            ctx.warn('Failed to publish nanopub via %s: %s', server, e)
+            if span is not None:
+                span.fail(str(e))
+            return False
+    return True
 
 
 def _store_triple_store(nanopub: str, ctx: NanopubProcessingContext) -> bool:
     try:
-        store_to_triple_store(
-            cfg=ctx.cfg,
-            data=nanopub,
-            input_format='trig',
-        )
+        with ctx.span('sparql.build'):
+            query = Offload.get().run(build_query, ctx.cfg, nanopub, ctx.output_format,
+                                      size=len(nanopub))
+        with ctx.span('sparql.update', **{'http.url': ctx.cfg.triple_store.sparql_endpoint}):
+            update_triple_store(cfg=ctx.cfg, query=query)
     except Exception as e:
-        ctx.warn(f'Failed to store nanopub in triple store: {str(e)}')
+        ctx.warn('Failed to store nanopub in triple store: %s', e)
         return False
     return True
 
 
 def _np(*args, ctx: NanopubProcessingContext) -> Tuple[int, str, str]:
-    p = subprocess.Popen(
-        args=[ctx.cfg.nanopub.client_exec, *args],
-        cwd=str(ctx.cfg.nanopub.workdir),
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = p.communicate(timeout=ctx.cfg.nanopub.client_timeout)
+    with ctx.span('np', **{'np.command': args[0]}) as span:
+        p = subprocess.Popen(
+            args=[ctx.cfg.nanopub.client_exec, *args],
+            cwd=str(ctx.cfg.nanopub.workdir),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = p.communicate(timeout=ctx.client_timeout)
+        if span is not None:
+            span.set('np.exit_code', p.returncode)
     return p.returncode, stdout.decode(DEFAULT_ENCODING), stderr.decode(DEFAULT_ENCODING)
 
 
@@ -178,7 +284,7 @@ def _run_np_trusty(ctx: NanopubProcessingContext) -> str:
         ctx=ctx,
     )
     if exit_code != EXIT_SUCCESS:
-        LOG.warn(f'Failed to make TrustyURI ({exit_code}):\n{stdout}\n\n{stderr}')
+        ctx.warn('Failed to make TrustyURI (%s):\n%s\n\n%s', exit_code, stdout, stderr)
         raise NanopubProcessingError(
             status_code=500,
             message='Failed to make TrustyURI for nanopub.'
@@ -195,7 +301,7 @@ def _run_np_sign(ctx: NanopubProcessingContext) -> str:
         ctx=ctx,
     )
     if exit_code != EXIT_SUCCESS:
-        LOG.warn(f'Failed to sign the nanopub ({exit_code}):\n{stdout}\n\n{stderr}')
+        ctx.warn('Failed to sign the nanopub (%s):\n%s\n\n%s', exit_code, stdout, stderr)
         raise NanopubProcessingError(
             status_code=500,
             message='Failed to sign the nanopub.'
@@ -214,31 +320,83 @@ def _extract_np_uri(nanopub: str) -> Optional[str]:
     return last_this_prefix
 
 
-def process(cfg: SubmitterConfig, req_cfg: RequestConfig,
-            submission_id: str, data: str) -> NanopubSubmissionResult:
-    ctx = NanopubProcessingContext(
-        submission_id=submission_id,
-        cfg=cfg,
-        req_cfg=req_cfg,
-    )
-    ctx.debug('Preprocessing nanopublication as RDF')
+def _parse(data: str, input_format: str, validate: bool) -> Optional[StructureIndex]:
+    if input_format == FORMAT_NQUADS:
+        # line-oriented, no need to build a full graph
+        return index_nquads(data)
+    store = parse_rdf(data=data, input_format=input_format)
+    if not validate:
+        return None
+    return StructureIndex.from_store(store)
+
+
+def check_input(cfg: SubmitterConfig, data: str,
+                input_format: str) -> Optional[list[NanopubStats]]:
+    """Parses input and checks nanopub structure (may run in offload pool)"""
     try:
-        graph = rdflib.ConjunctiveGraph()
-        graph.parse(data=data, format='trig')
+        index = _parse(data=data, input_format=input_format,
+                       validate=cfg.validation.enabled)
     except Exception as e:
-        ctx.warn(f'Failed to preprocess nanopub: {str(e)}')
         raise NanopubProcessingError(400, f'Invalid RDF:\n{str(e)}')
+    if index is None or not cfg.validation.enabled:
+        return None
+    try:
+        return validate_index(
+            index=index,
+            cfg=cfg.validation,
+            this_prefixes=count_this_prefixes(data)
+            if input_format == FORMAT_TRIG else None,
+        )
+    except NanopubValidationError as e:
+        raise NanopubProcessingError(400, f'Invalid nanopub:\n{e.message}')
+
 
+def _preprocess(data: str, ctx: NanopubProcessingContext):
+    ctx.debug('Preprocessing nanopublication as RDF (%s)', ctx.input_format)
+    offload = Offload.get()
+    try:
+        with ctx.span('preprocess', **{'input.size': len(data),
+                                       'input.format': ctx.input_format,
+                                       'offloaded': offload.should_offload(len(data))}) as span:
+            stats = offload.run(check_input, ctx.cfg, data, ctx.input_format,
+                                size=len(data))
+            if span is not None and stats is not None:
+                span.set('nanopubs', len(stats))
+                span.set('triples', sum(s.triples for s in stats))
+    except NanopubProcessingError as e:
+        ctx.warn('Failed to preprocess nanopub: %s', e.message)
+        raise
+    if stats is not None:
+        ctx.debug('Found %d nanopub(s) with %d triple(s)',
+                  len(stats), sum(s.triples for s in stats))
+
+
+def _store_input(data: str, ctx: NanopubProcessingContext):
     ctx.debug('Storing nanopub as file locally')
-    np_file = cfg.nanopub.workdir / ctx.input_file
+    np_file = ctx.cfg.nanopub.workdir / ctx.input_file
     try:
-        np_file.parent.mkdir(parents=True, exist_ok=True)
-        np_file.write_text(data, encoding=DEFAULT_ENCODING)
+        with ctx.span('workdir.write'):
+            np_file.parent.mkdir(parents=True, exist_ok=True)
+            np_file.write_text(data, encoding=DEFAULT_ENCODING)
     except Exception as e:
-        ctx.error(f'Failed to store nanopub: {str(e)}')
+        ctx.error('Failed to store nanopub: %s', e)
         ctx.cleanup()
         raise NanopubProcessingError(500, 'Failed to store nanopub locally')
 
+
+def process(cfg: SubmitterConfig, req_cfg: RequestConfig,
+            submission_id: str, data: str, trace: Optional[Trace] = None,
+            input_format: str = FORMAT_TRIG) -> NanopubSubmissionResult:
+    ctx = NanopubProcessingContext(
+        submission_id=submission_id,
+        cfg=cfg,
+        req_cfg=req_cfg,
+        trace=trace,
+        input_format=input_format,
+    )
+    _preprocess(data=data, ctx=ctx)
+    _store_input(data=data, ctx=ctx)
+
     if cfg.nanopub.sign_nanopub:
         ctx.debug('Signing nanopub with private key')
         result_file = _run_np_sign(ctx=ctx)
@@ -252,7 +410,7 @@ def process(cfg: SubmitterConfig, req_cfg: RequestConfig,
         nanopub = result_path.read_text(encoding=DEFAULT_ENCODING)
         nanopub_uri = _extract_np_uri(nanopub)
     except Exception as e:
-        ctx.error(f'Failed to read nanopub: {str(e)}')
+        ctx.error('Failed to read nanopub: %s', e)
         ctx.cleanup()
         raise NanopubProcessingError(500, 'Failed to read nanopub locally')
 
@@ -264,9 +422,33 @@ def process(cfg: SubmitterConfig, req_cfg: RequestConfig,
     if ctx.uri_replace is not None:
         old, new = ctx.uri_replace.split('|', maxsplit=1)
         new_uri = nanopub_uri.replace(old, new)
-        LOG.debug(f'Replacing {nanopub_uri} with {new_uri}')
+        ctx.debug('Replacing %s with %s', nanopub_uri, new_uri)
         nanopub_uri = new_uri
 
+    if Outbox.get().enabled:
+        result = _deliver_outbox(nanopub=nanopub, nanopub_uri=nanopub_uri, ctx=ctx)
+    else:
+        result = _deliver_direct(nanopub=nanopub, nanopub_uri=nanopub_uri, ctx=ctx)
+    result.nanopub = nanopub
+    _cache_nanopubs(nanopub_bundle=nanopub, ctx=ctx)
+    ctx.debug('Processing finished')
+    ctx.cleanup()
+    return result
+
+
+def _cache_nanopubs(nanopub_bundle: str, ctx: NanopubProcessingContext):
+    cache = NanopubCache.get()
+    if not cache.enabled:
+        return
+    for nanopub in _split_nanopubs(nanopub_bundle):
+        code = _nanopub_code(nanopub)
+        if code is not None:
+            ctx.debug('Caching nanopub %s', code)
+            cache.put(code, nanopub.encode(encoding=DEFAULT_ENCODING))
+
+
+def _deliver_direct(nanopub: str, nanopub_uri: str,
+                    ctx: NanopubProcessingContext) -> NanopubSubmissionResult:
     ctx.debug('Submitting nanopub(s) to server(s)')
     servers = _publish_nanopub(nanopub_bundle=nanopub, ctx=ctx)
 
@@ -277,14 +459,98 @@ def process(cfg: SubmitterConfig, req_cfg: RequestConfig,
                                           ' to any nanopub server.')
 
     triple_store = None
-    if cfg.triple_store.enabled:
-        ctx.debug(f'Sending nanopub to: {cfg.triple_store.sparql_endpoint}')
+    if ctx.cfg.triple_store.enabled:
+        ctx.debug('Sending nanopub to: %s', ctx.cfg.triple_store.sparql_endpoint)
         triple_store = _store_triple_store(nanopub=nanopub, ctx=ctx)
 
-    ctx.debug('Processing finished')
-    ctx.cleanup()
     return NanopubSubmissionResult(
         location=nanopub_uri,
         servers=servers,
         triple_store=triple_store,
     )
+
+
+def _deliver_outbox(nanopub: str, nanopub_uri: str,
+                    ctx: NanopubProcessingContext) -> NanopubSubmissionResult:
+    servers = []  # type: list[str]
+    remaining = ctx.target_servers
+    if ctx.cfg.outbox.publish_first:
+        ctx.debug('Submitting nanopub(s) to first available server')
+        servers, remaining = _publish_first(nanopub_bundle=nanopub, servers=remaining, ctx=ctx)
+        if len(servers) == 0:
+            ctx.error('Failed to publish nanopub')
+            ctx.cleanup()
+            raise NanopubProcessingError(500, 'Could not publish nanopublication'
+                                              ' to any nanopub server.')
+
+    deliveries = [(KIND_PUBLISH, server) for server in remaining]
+    if ctx.cfg.triple_store.enabled:
+        deliveries.append((KIND_TRIPLE_STORE, ctx.cfg.triple_store.sparql_endpoint))
+    if ctx.cfg.mail.enabled:
+        deliveries.append((KIND_MAIL, ', '.join(ctx.cfg.mail.recipients)))
+    if len(deliveries) > 0:
+        ctx.debug('Enqueuing %d delivery(ies) to outbox', len(deliveries))
+        try:
+            with ctx.span('outbox.enqueue', deliveries=len(deliveries)):
+                Outbox.get().enqueue(
+                    submission_id=ctx.id,
+                    uri=nanopub_uri,
+                    data=nanopub,
+                    deliveries=deliveries,
+                )
+        except Exception as e:
+            ctx.error('Failed to enqueue deliveries: %s', e)
+            ctx.cleanup()
+            raise NanopubProcessingError(500, 'Failed to enqueue nanopublication'
+                                              ' for delivery.')
+    return NanopubSubmissionResult(
+        location=nanopub_uri,
+        servers=servers,
+        triple_store=None,
+        queued=deliveries,
+    )
+
+
+def _delivery_context(cfg: SubmitterConfig, entry: OutboxEntry) -> NanopubProcessingContext:
+    return NanopubProcessingContext(
+        submission_id=entry.submission_id,
+        cfg=cfg,
+        req_cfg=RequestConfig(servers=[], uri_replace=None),
+    )
+
+
+def deliver_publish(cfg: SubmitterConfig, entry: OutboxEntry):
+    """Outbox handler publishing queued nanopub to a single server"""
+    ctx = _delivery_context(cfg=cfg, entry=entry)
+    nanopubs = _split_nanopubs(entry.data)
+    if not _publish_via(server=entry.target, nanopubs=nanopubs, ctx=ctx):
+        raise RuntimeError(f'Failed to publish via {entry.target}')
+
+
+def deliver_triple_store(cfg: SubmitterConfig, entry: OutboxEntry):
+    """Outbox handler storing queued nanopub in the triple store"""
+    ctx = _delivery_context(cfg=cfg, entry=entry)
+    query = Offload.get().run(build_query, cfg, entry.data, ctx.output_format,
+                              size=len(entry.data))
+    update_triple_store(cfg=cfg, query=query)
+    ctx.info('Nanopub stored in triple store')
+
+
+def warm_up(cfg: SubmitterConfig) -> bool:
+    """Runs np client on a sample nanopub (loads jar and JVM into caches)"""
+    ctx = NanopubProcessingContext(
+        submission_id=f'warmup-{os.getpid()}',
+        cfg=cfg,
+        req_cfg=RequestConfig(servers=[], uri_replace=None),
+    )
+    try:
+        np_file = cfg.nanopub.workdir / ctx.input_file
+        np_file.parent.mkdir(parents=True, exist_ok=True)
+        np_file.write_text(WARMUP_NANOPUB, encoding=DEFAULT_ENCODING)
+        _run_np_trusty(ctx=ctx)
+    except Exception as e:
+        ctx.warn('Failed to warm up np client: %s', e)
+        return False
+    finally:
+        ctx.cleanup()
+    return True
@@ -0,0 +1,57 @@
+import re
+
+from typing import Iterator, Tuple
+
+from nanopub_submitter.validation import StructureIndex
+
+DEFAULT_GRAPH = ''
+
+_IRI = r'<([^<>"{}|^`\\\x00-\x20]*)>'
+_BNODE = r'(_:[A-Za-z0-9_][A-Za-z0-9_\-.]*)'
+_LITERAL = r'("(?:[^"\\\n\r]|\\.)*"(?:@[A-Za-z]+(?:-[A-Za-z0-9]+)*|\^\^<[^<>"\x00-\x20]*>)?)'
+
+NQUAD_PATTERN = re.compile(
+    rf'^\s*(?:{_IRI}|{_BNODE})'
+    rf'\s*{_IRI}'
+    rf'\s*(?:{_IRI}|{_BNODE}|{_LITERAL})'
+    rf'\s*(?:{_IRI}|{_BNODE})?'
+    r'\s*\.\s*(?:#.*)?$'
+)
+
+
+class NQuadsSyntaxError(ValueError):
+
+    def __init__(self, line_number: int, line: str):
+        message = f'Invalid N-Quads statement on line {line_number}: {line.strip()[:200]}'
+        super().__init__(message)
+        self.message = message
+
+
+def iter_nquads(data: str) -> Iterator[Tuple[str, str, str, str]]:
+    """Parses N-Quads line by line, yields (s, p, o, g) as plain strings"""
+    for number, line in enumerate(data.splitlines(), start=1):
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        match = NQUAD_PATTERN.match(line)
+        if match is None:
+            raise NQuadsSyntaxError(number, line)
+        s_iri, s_bnode, p, o_iri, o_bnode, o_literal, g_iri, g_bnode = match.groups()
+        yield (
+            s_iri if s_iri is not None else s_bnode,
+            p,
+            o_iri if o_iri is not None else (o_bnode or o_literal),
+            g_iri if g_iri is not None else (g_bnode or DEFAULT_GRAPH),
+        )
+
+
+def index_nquads(data: str) -> StructureIndex:
+    index = StructureIndex()
+    seen = set()  # type: set[Tuple[str, str, str, str]]
+    for quad in iter_nquads(data):
+        # repeated statements count once (as in an RDF dataset)
+        if quad in seen:
+            continue
+        seen.add(quad)
+        index.add(*quad)
+    return index
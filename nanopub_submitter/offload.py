@@ -0,0 +1,96 @@
+import atexit
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import os
+import threading
+
+from typing import Any, Callable
+from typing import Optional  # noqa: F401
+
+from nanopub_submitter.config import SubmitterConfig
+from nanopub_submitter.logger import LOG, init_config_logging
+
+_WORKER_CFG = None  # type: Optional[SubmitterConfig]
+
+
+def _init_worker(config: SubmitterConfig):
+    global _WORKER_CFG
+    init_config_logging(config=config)
+    _WORKER_CFG = config
+
+
+def _call(func: Callable, *args) -> Any:
+    # config is sent once per worker, only the arguments per call
+    return func(_WORKER_CFG, *args)
+
+
+class Offload:
+    """Process pool for CPU-bound work (RDF parsing, query building)"""
+    _instance = None
+
+    def __init__(self):
+        self.cfg = None
+        self.lock = threading.Lock()
+        self.pool = None  # type: Optional[concurrent.futures.ProcessPoolExecutor]
+
+    @classmethod
+    def init(cls, config: SubmitterConfig):
+        instance = cls.get()
+        instance.shutdown()
+        instance.cfg = config
+        if config.offload.enabled:
+            instance._start()
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = Offload()
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.pool is not None
+
+    def _start(self):
+        workers = self.cfg.offload.workers or os.cpu_count() or 1
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.cfg,),
+        )
+        LOG.info('Offloading inputs over %d bytes to %d process(es)',
+                 self.cfg.offload.min_size, workers)
+
+    def should_offload(self, size: int) -> bool:
+        return self.enabled and size >= self.cfg.offload.min_size
+
+    def run(self, func: Callable, cfg: SubmitterConfig, *args, size: int = 0) -> Any:
+        """Calls func(cfg, *args), in the pool if the input is large enough"""
+        pool = self.pool
+        if pool is None or not self.should_offload(size):
+            return func(cfg, *args)
+        try:
+            return pool.submit(_call, func, *args).result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            LOG.error('Offload pool is broken, restarting: %s', e)
+            self._restart(failed=pool)
+            return func(cfg, *args)
+
+    def _restart(self, failed: concurrent.futures.ProcessPoolExecutor):
+        with self.lock:
+            # concurrent calls see the same broken pool, replace it once
+            if self.pool is not failed:
+                return
+            failed.shutdown(wait=False, cancel_futures=True)
+            self._start()
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+
+atexit.register(lambda: Offload.get().shutdown())
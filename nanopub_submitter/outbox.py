@@ -0,0 +1,275 @@
+import atexit
+import contextlib
+import os
+import pathlib
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+
+from typing import Callable, Optional
+
+from nanopub_submitter.config import SubmitterConfig
+from nanopub_submitter.logger import LOG
+
+KIND_PUBLISH = 'publish'
+KIND_TRIPLE_STORE = 'triple_store'
+KIND_MAIL = 'mail'
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payloads (
+    submission_id TEXT PRIMARY KEY,
+    uri TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    submission_id TEXT NOT NULL REFERENCES payloads(submission_id),
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (status, next_attempt);
+"""
+# columns added to deliveries after the first version of the schema
+MIGRATIONS = (
+    ('owner', 'ALTER TABLE deliveries ADD COLUMN owner TEXT'),
+    ('lease_until', 'ALTER TABLE deliveries ADD COLUMN lease_until REAL'),
+)
+
+
+class OutboxEntry:
+
+    def __init__(self, entry_id: int, submission_id: str, kind: str,
+                 target: str, attempts: int, uri: str, data: str):
+        self.id = entry_id
+        self.submission_id = submission_id
+        self.kind = kind
+        self.target = target
+        self.attempts = attempts
+        self.uri = uri
+        self.data = data
+
+
+DeliveryHandler = Callable[[SubmitterConfig, OutboxEntry], None]
+
+
+class Outbox:
+    """Durable queue of downstream deliveries (SQLite in WAL mode)"""
+    _instance = None
+
+    POLL_INTERVAL = 1.0
+
+    def __init__(self):
+        self.cfg = None
+        self.handlers = dict()  # type: dict[str, DeliveryHandler]
+        self.db = None  # type: Optional[sqlite3.Connection]
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []  # type: list[threading.Thread]
+        # claims of this process (several may share the database)
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}'
+
+    @classmethod
+    def init(cls, config: SubmitterConfig, handlers: dict[str, DeliveryHandler]):
+        instance = cls.get()
+        instance.shutdown()
+        instance.cfg = config
+        instance.handlers = handlers
+        if not config.outbox.enabled:
+            return
+        instance._open()
+        instance._start_workers()
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = Outbox()
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.db is not None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self.db is None:
+            raise RuntimeError('Outbox is not enabled')
+        return self.db
+
+    @property
+    def path(self) -> pathlib.Path:
+        if self.cfg.outbox.path:
+            return pathlib.Path(self.cfg.outbox.path)
+        return self.cfg.nanopub.workdir / 'outbox.sqlite3'
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self.path), check_same_thread=False,
+                             isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=FULL')
+        db.executescript(SCHEMA)
+        columns = {row[1] for row in db.execute('PRAGMA table_info(deliveries)')}
+        for column, statement in MIGRATIONS:
+            if column not in columns:
+                db.execute(statement)
+        # deliveries of crashed or restarted processes (other processes
+        # may still be delivering theirs, so only expired leases)
+        recovered = db.execute(
+            'UPDATE deliveries SET status = ?, owner = NULL, lease_until = NULL '
+            'WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)',
+            (STATUS_PENDING, STATUS_RUNNING, time.time()),
+        ).rowcount
+        pending = db.execute(
+            'SELECT COUNT(*) FROM deliveries WHERE status = ?',
+            (STATUS_PENDING,),
+        ).fetchone()[0]
+        LOG.info('Outbox opened: %s (%d pending, %d recovered)',
+                 self.path, pending, recovered)
+        self.db = db
+
+    def _start_workers(self):
+        self.stopping.clear()
+        for i in range(max(self.cfg.outbox.workers, 1)):
+            thread = threading.Thread(
+                target=self._run,
+                name=f'outbox-{i}',
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # write lock is taken at BEGIN, so reads and updates inside are
+        # atomic also towards other processes sharing the database
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def enqueue(self, submission_id: str, uri: str, data: str,
+                deliveries: list[tuple[str, str]]):
+        """Stores payload and its deliveries in a single durable transaction"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO payloads (submission_id, uri, data, created) '
+                'VALUES (?, ?, ?, ?)',
+                (submission_id, uri, data, now),
+            )
+            conn.executemany(
+                'INSERT INTO deliveries (submission_id, kind, target, status, next_attempt) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(submission_id, kind, target, STATUS_PENDING, now)
+                 for kind, target in deliveries],
+            )
+        self.wakeup.set()
+
+    def _claim(self) -> Optional[OutboxEntry]:
+        now = time.time()
+        with self._transaction() as conn:
+            # pending ones that are due, or running ones with expired lease
+            row = conn.execute(
+                'SELECT d.id, d.submission_id, d.kind, d.target, d.attempts, p.uri, p.data '
+                'FROM deliveries d JOIN payloads p ON p.submission_id = d.submission_id '
+                'WHERE (d.status = ? AND d.next_attempt <= ?) '
+                'OR (d.status = ? AND (d.lease_until IS NULL OR d.lease_until < ?)) '
+                'ORDER BY d.next_attempt LIMIT 1',
+                (STATUS_PENDING, now, STATUS_RUNNING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE deliveries SET status = ?, owner = ?, lease_until = ? WHERE id = ?',
+                (STATUS_RUNNING, self.owner, now + self.cfg.outbox.lease, row[0]),
+            )
+        return OutboxEntry(*row)
+
+    def _complete(self, entry: OutboxEntry):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM deliveries WHERE id = ?', (entry.id,))
+            conn.execute(
+                'DELETE FROM payloads WHERE submission_id = ? AND NOT EXISTS '
+                '(SELECT 1 FROM deliveries WHERE submission_id = ?)',
+                (entry.submission_id, entry.submission_id),
+            )
+
+    def _retry(self, entry: OutboxEntry, error: str):
+        attempts = entry.attempts + 1
+        if attempts >= self.cfg.outbox.max_attempts:
+            status, next_attempt = STATUS_FAILED, time.time()
+            LOG.error('Delivery %s to %s for %s failed permanently: %s',
+                      entry.kind, entry.target, entry.submission_id, error)
+        else:
+            delay = min(self.cfg.outbox.backoff * 2 ** entry.attempts,
+                        self.cfg.outbox.max_backoff)
+            status, next_attempt = STATUS_PENDING, time.time() + delay
+            LOG.warning('Delivery %s to %s for %s failed (attempt %d, retry in %.1fs): %s',
+                        entry.kind, entry.target, entry.submission_id,
+                        attempts, delay, error)
+        with self.lock:
+            # unless lease expired and the delivery was claimed by another process
+            self.conn.execute(
+                'UPDATE deliveries SET status = ?, attempts = ?, next_attempt = ?, '
+                'last_error = ?, owner = NULL, lease_until = NULL '
+                'WHERE id = ? AND owner = ?',
+                (status, attempts, next_attempt, error[:1000], entry.id, self.owner),
+            )
+
+    def _deliver(self, entry: OutboxEntry):
+        handler = self.handlers.get(entry.kind, None)
+        try:
+            if handler is None:
+                raise RuntimeError(f'No handler for delivery kind: {entry.kind}')
+            handler(self.cfg, entry)
+        except Exception as e:
+            self._retry(entry, str(e))
+            return
+        self._complete(entry)
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                entry = self._claim()
+            except Exception as e:
+                LOG.error('Failed to read outbox: %s', e)
+                entry = None
+            if entry is None:
+                self.wakeup.wait(timeout=self.POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            try:
+                self._deliver(entry)
+            except Exception as e:
+                LOG.error('Failed to update outbox entry %d: %s', entry.id, e)
+
+    def shutdown(self):
+        self.stopping.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.threads = []
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+atexit.register(lambda: Outbox.get().shutdown())
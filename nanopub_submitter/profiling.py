@@ -0,0 +1,100 @@
+import cProfile
+import collections
+import pathlib
+import sys
+import threading
+import time
+
+from typing import Any, Callable, Optional
+
+from nanopub_submitter.config import SubmitterConfig
+from nanopub_submitter.logger import LOG
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({pathlib.Path(code.co_filename).name}:{code.co_firstlineno})'
+
+
+def _folded_stack(thread_name: str, frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ';'.join(reversed(labels))
+
+
+class Profiler:
+    _instance = None
+
+    def __init__(self):
+        self.cfg = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def init(cls, config: SubmitterConfig):
+        cls.get().cfg = config
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = Profiler()
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.cfg is not None and self.cfg.profiling.enabled
+
+    @property
+    def directory(self) -> pathlib.Path:
+        return pathlib.Path(self.cfg.profiling.directory)
+
+    def sample(self, seconds: float, interval: float) -> str:
+        """Samples stacks of all threads, returns folded (flamegraph) format"""
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusyError('Profiling already in progress')
+        try:
+            seconds = min(max(seconds, 0.1), self.cfg.profiling.max_seconds)
+            interval = max(interval, 0.001)
+            me = threading.get_ident()
+            counts = collections.Counter()  # type: collections.Counter[str]
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    counts[_folded_stack(names.get(ident, str(ident)), frame)] += 1
+                time.sleep(interval)
+            return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+        finally:
+            self.lock.release()
+
+    def profile_call(self, profile_id: str, func: Callable, *args, **kwargs) -> Any:
+        """Runs the call under cProfile and stores stats as <profile_id>.prof"""
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                profile.dump_stats(str(self.profile_path(profile_id)))
+            except Exception as e:
+                LOG.warning('Failed to store profile %s: %s', profile_id, e)
+
+    def profile_path(self, profile_id: str) -> pathlib.Path:
+        return self.directory / f'{profile_id}.prof'
+
+    def find_profile(self, profile_id: str) -> Optional[pathlib.Path]:
+        path = self.profile_path(profile_id)
+        if path.parent != self.directory or not path.is_file():
+            return None
+        return path
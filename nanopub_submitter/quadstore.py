@@ -0,0 +1,165 @@
+import array
+
+from typing import Iterator, Optional, Tuple
+
+RDF_TYPE_N3 = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+
+Triple = Tuple[str, str, str]
+
+
+def iri_n3(iri: str) -> str:
+    return f'<{iri}>'
+
+
+def n3_value(term: str) -> str:
+    """IRI without angle brackets (other terms as they are)"""
+    if term.startswith('<') and term.endswith('>'):
+        return term[1:-1]
+    return term
+
+
+class QuadStore:
+    """Quads as columns of integer IDs of interned terms (N3 strings)
+
+    Like an rdflib store, it is a set: repeated quads are stored once.
+    """
+
+    def __init__(self):
+        self.terms = []  # type: list[str]
+        self.ids = dict()  # type: dict[str, int]
+        self.s = array.array('I')
+        self.p = array.array('I')
+        self.o = array.array('I')
+        self.g = array.array('I')
+        # quads packed into single ints (term IDs are 32-bit)
+        self.seen = set()  # type: set[int]
+        self.default_graph = self.intern('')
+        self.bindings = dict()  # type: dict[str, str]
+
+    def intern(self, term: str) -> int:
+        term_id = self.ids.get(term, None)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.terms.append(term)
+            self.ids[term] = term_id
+        return term_id
+
+    def lookup(self, term: str) -> Optional[int]:
+        return self.ids.get(term, None)
+
+    def add(self, s: str, p: str, o: str, g: str = ''):
+        ids = self.intern(s), self.intern(p), self.intern(o), self.intern(g)
+        key = ids[0] << 96 | ids[1] << 64 | ids[2] << 32 | ids[3]
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        self.s.append(ids[0])
+        self.p.append(ids[1])
+        self.o.append(ids[2])
+        self.g.append(ids[3])
+
+    def bind(self, prefix: str, namespace: str):
+        self.bindings[prefix] = namespace
+
+    def resolve(self, prefix: str) -> Optional[str]:
+        """Namespace of prefix (last binding), e.g. this:"""
+        return self.bindings.get(prefix, None)
+
+    def __len__(self) -> int:
+        return len(self.s)
+
+    def contexts(self) -> list[str]:
+        """Named graphs in order of first appearance"""
+        seen = dict.fromkeys(self.g)
+        return [self.terms[g] for g in seen if g != self.default_graph]
+
+    def _rows(self, union: bool, context: Optional[int]) -> Iterator[int]:
+        if union:
+            return iter(range(len(self.s)))
+        return (i for i, g in enumerate(self.g) if g == context)
+
+    def triples(self, context: Optional[str] = None, union: bool = False) -> Iterator[Triple]:
+        """Triples of given graph (default graph if None) or of all graphs"""
+        context_id = self.default_graph if context is None else self.lookup(context)
+        if context_id is None and not union:
+            return
+        terms = self.terms
+        for i in self._rows(union=union, context=context_id):
+            yield terms[self.s[i]], terms[self.p[i]], terms[self.o[i]]
+
+    def subjects_of_type(self, type_term: str, context: Optional[str] = None,
+                         union: bool = False) -> list[str]:
+        type_id, rdf_type_id = self.lookup(type_term), self.lookup(RDF_TYPE_N3)
+        if type_id is None or rdf_type_id is None:
+            return []
+        context_id = self.default_graph if context is None else self.lookup(context)
+        return [
+            self.terms[self.s[i]]
+            for i in self._rows(union=union, context=context_id)
+            if self.p[i] == rdf_type_id and self.o[i] == type_id
+        ]
+
+    def quads_ids(self) -> Iterator[Tuple[int, int, int, int]]:
+        return zip(self.s, self.p, self.o, self.g)
+
+
+_SINK_CLASS = None
+
+
+def _sink_class():
+    global _SINK_CLASS
+    if _SINK_CLASS is not None:
+        return _SINK_CLASS
+    import rdflib.store  # type: ignore
+
+    class QuadStoreSink(rdflib.store.Store):
+        """Write-only rdflib store feeding parsed quads into QuadStore"""
+        context_aware = True
+        formula_aware = False
+        graph_aware = False
+        transaction_aware = False
+
+        def __init__(self, quad_store: QuadStore):
+            super().__init__()
+            self.quad_store = quad_store
+            self.default_context = None
+
+        def add(self, triple, context, quoted=False):
+            s, p, o = triple
+            identifier = getattr(context, 'identifier', context)
+            g = '' if identifier is None or identifier == self.default_context \
+                else identifier.n3()
+            self.quad_store.add(s.n3(), p.n3(), o.n3(), g)
+
+        def addN(self, quads):
+            for s, p, o, c in quads:
+                self.add((s, p, o), c)
+
+        def bind(self, prefix, namespace, override=True):
+            self.quad_store.bind(str(prefix), str(namespace))
+
+        def namespace(self, prefix):
+            return None
+
+        def prefix(self, namespace):
+            return None
+
+        def namespaces(self):
+            return iter(())
+
+        def __len__(self, context=None):
+            return len(self.quad_store)
+
+    _SINK_CLASS = QuadStoreSink
+    return _SINK_CLASS
+
+
+def parse_rdf(data: str, input_format: str) -> QuadStore:
+    """Parses RDF with rdflib directly into QuadStore (no rdflib indexes)"""
+    import rdflib  # type: ignore
+    quad_store = QuadStore()
+    sink = _sink_class()(quad_store)
+    graph = rdflib.ConjunctiveGraph(store=sink)
+    sink.default_context = graph.default_context.identifier
+    graph.parse(data=data, format=input_format)
+    return quad_store
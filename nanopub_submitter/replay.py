@@ -0,0 +1,198 @@
+import argparse
+import base64
+import collections
+import concurrent.futures
+import json
+import pathlib
+import sys
+import threading
+import time
+
+from typing import Iterator, Optional
+
+import requests
+
+from nanopub_submitter.capture import CAPTURE_PATH, REDACTED
+
+PERCENTILES = (0.5, 0.9, 0.99)
+MAX_LAG = 0.1
+
+
+def iter_capture(path: pathlib.Path) -> Iterator[dict]:
+    with path.open(encoding='utf-8') as fp:
+        for line in fp:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('body', None) is not None:
+                yield entry
+
+
+def load_results(path: pathlib.Path) -> list[dict]:
+    with path.open(encoding='utf-8') as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+class Distribution:
+
+    def __init__(self, name: str, durations: list[float], statuses: list[int]):
+        self.name = name
+        self.durations = sorted(durations)
+        self.statuses = collections.Counter(statuses)
+
+    def percentile(self, p: float) -> float:
+        if len(self.durations) == 0:
+            return 0.0
+        return self.durations[min(int(len(self.durations) * p), len(self.durations) - 1)]
+
+    @classmethod
+    def from_entries(cls, name: str, entries: list[dict]) -> 'Distribution':
+        return cls(
+            name=name,
+            durations=[e['duration'] for e in entries],
+            statuses=[e['status'] for e in entries],
+        )
+
+    def row(self) -> list[str]:
+        return [
+            self.name,
+            str(len(self.durations)),
+            *[f'{self.percentile(p) * 1000:.0f}' for p in PERCENTILES],
+            f'{self.percentile(1.0) * 1000:.0f}',
+            ' '.join(f'{s}:{n}' for s, n in sorted(self.statuses.items())),
+        ]
+
+
+def compare(distributions: list[Distribution]) -> str:
+    header = ['run', 'n', *[f'p{int(p * 100)}[ms]' for p in PERCENTILES], 'max[ms]', 'status']
+    rows = [header] + [d.row() for d in distributions]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    lines = ['  '.join(cell.ljust(w) for cell, w in zip(row, widths)) for row in rows]
+    base = distributions[0]
+    for other in distributions[1:]:
+        for p in PERCENTILES:
+            before, after = base.percentile(p), other.percentile(p)
+            if before > 0:
+                lines.append(f'{other.name} vs {base.name} p{int(p * 100)}: '
+                             f'{(after - before) / before * 100:+.1f}%')
+    return '\n'.join(lines)
+
+
+class Replayer:
+
+    def __init__(self, target: str, token: Optional[str], speed: float,
+                 concurrency: int, timeout: float):
+        self.url = target.rstrip('/') + CAPTURE_PATH
+        self.token = token
+        self.speed = speed
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.lock = threading.Lock()
+        self.results = []  # type: list[dict]
+        self.max_lag = 0.0
+
+    def _headers(self, entry: dict) -> dict[str, str]:
+        headers = {k: v for k, v in entry.get('headers', {}).items()
+                   if v != REDACTED}
+        if self.token is not None:
+            headers['Authorization'] = f'Bearer {self.token}'
+        return headers
+
+    def _send(self, entry: dict):
+        start = time.perf_counter()
+        try:
+            r = self.session.post(
+                url=self.url,
+                data=base64.b64decode(entry['body']),
+                headers=self._headers(entry),
+                timeout=self.timeout,
+            )
+            status = r.status_code
+        except Exception:
+            status = 0
+        result = {
+            'submission_id': entry.get('submission_id', None),
+            'status': status,
+            'duration': time.perf_counter() - start,
+            'original_status': entry.get('status', 0),
+            'original_duration': entry.get('duration', 0.0),
+        }
+        with self.lock:
+            self.results.append(result)
+
+    def run(self, entries: list[dict]) -> list[dict]:
+        started = time.monotonic()
+        first_arrival = None  # type: Optional[float]
+        futures = []
+        # capture is written as requests complete, not as they arrive
+        for entry in sorted(entries, key=lambda e: e['arrival']):
+            if first_arrival is None:
+                first_arrival = entry['arrival']
+            if self.speed > 0:
+                due = started + (entry['arrival'] - first_arrival) / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+            futures.append(self.executor.submit(self._send, entry))
+        concurrent.futures.wait(futures)
+        self.executor.shutdown()
+        return self.results
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='nanopub-replay',
+        description='Replay captured /submit requests and compare latencies',
+    )
+    parser.add_argument('capture', type=pathlib.Path, help='capture file (JSON lines)')
+    parser.add_argument('-t', '--target', default='http://localhost:8080',
+                        help='submission service URL (default: %(default)s)')
+    parser.add_argument('--token', default=None,
+                        help='token for all requests (captured ones are redacted)')
+    parser.add_argument('-s', '--speed', type=float, default=1.0,
+                        help='N× original pacing, 0 = as fast as possible '
+                             '(default: %(default)s)')
+    parser.add_argument('-c', '--concurrency', type=int, default=32,
+                        help='max requests in flight (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='request timeout in seconds (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=pathlib.Path, default=None,
+                        help='write results (JSON lines) for later comparison')
+    parser.add_argument('--baseline', type=pathlib.Path, action='append', default=[],
+                        help='results of previous replay to compare with')
+    args = parser.parse_args(argv)
+
+    replayer = Replayer(
+        target=args.target,
+        token=args.token,
+        speed=args.speed,
+        concurrency=max(args.concurrency, 1),
+        timeout=args.timeout,
+    )
+    # read whole capture first, target may be appending to it
+    results = replayer.run(list(iter_capture(args.capture)))
+    if args.output is not None:
+        with args.output.open('w', encoding='utf-8') as fp:
+            for result in results:
+                fp.write(json.dumps(result) + '\n')
+
+    distributions = [Distribution(
+        name='captured',
+        durations=[r['original_duration'] for r in results],
+        statuses=[r['original_status'] for r in results],
+    )]
+    for baseline in args.baseline:
+        distributions.append(Distribution.from_entries(baseline.stem, load_results(baseline)))
+    distributions.append(Distribution.from_entries('replay', results))
+    print(compare(distributions))
+    if replayer.max_lag > MAX_LAG:
+        print(f'Max schedule lag: {replayer.max_lag:.2f}s (pacing not kept)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
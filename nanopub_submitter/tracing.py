@@ -0,0 +1,330 @@
+import abc
+import atexit
+import contextlib
+import json
+import pathlib
+import queue
+import re
+import requests
+import secrets
+import threading
+import time
+
+from typing import Any, Iterator, Optional
+
+from nanopub_submitter.config import SubmitterConfig
+from nanopub_submitter.consts import PACKAGE_NAME, PACKAGE_VERSION
+from nanopub_submitter.logger import LOG
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACEPARENT_PATTERN = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Span:
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str,
+                 attributes: dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.end = None  # type: Optional[int]
+        self.status = STATUS_UNSET
+        self.status_message = ''
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def fail(self, message: str):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+
+class Trace:
+    """Spans of a single submission (used sequentially, not thread-safe)"""
+
+    def __init__(self, submission_id: str, traceparent: Optional[str] = None,
+                 enabled: bool = True, exported: bool = True):
+        self.submission_id = submission_id
+        self.enabled = enabled
+        self.exported = exported
+        self.trace_id = secrets.token_hex(16)
+        self.remote_parent = None  # type: Optional[str]
+        self.sampled = True
+        if traceparent is not None:
+            match = TRACEPARENT_PATTERN.match(traceparent.strip().lower())
+            if match is not None:
+                self.trace_id = match.group(1)
+                self.remote_parent = match.group(2)
+                self.sampled = int(match.group(3), 16) & 1 == 1
+        self.spans = []  # type: list[Span]
+        self.stack = []  # type: list[Span]
+
+    @property
+    def recording(self) -> bool:
+        return self.enabled and self.sampled
+
+    @property
+    def propagated(self) -> bool:
+        # spans recorded only locally have no meaning for other services
+        return self.exported or self.remote_parent is not None
+
+    @property
+    def traceparent(self) -> Optional[str]:
+        """Current span (or remote parent passed on), None if there is none"""
+        if len(self.stack) > 0:
+            span_id = self.stack[-1].span_id
+        elif self.remote_parent is not None:
+            span_id = self.remote_parent
+        else:
+            return None
+        flags = '01' if self.sampled else '00'
+        return f'00-{self.trace_id}-{span_id}-{flags}'
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        if not self.recording:
+            yield None
+            return
+        parent = self.stack[-1].span_id if len(self.stack) > 0 else self.remote_parent
+        span = Span(
+            trace_id=self.trace_id,
+            parent_id=parent,
+            name=name,
+            attributes={'submission.id': self.submission_id, **attributes},
+        )
+        self.spans.append(span)
+        self.stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(str(e))
+            raise
+        finally:
+            span.end = time.time_ns()
+            self.stack.pop()
+
+    def timings(self) -> dict[str, float]:
+        """Total duration (seconds) of recorded spans per name"""
+        result = dict()  # type: dict[str, float]
+        for span in self.spans:
+            result[span.name] = result.get(span.name, 0.0) + span.duration
+        return result
+
+    def finish(self):
+        if self.recording and len(self.spans) > 0:
+            Tracer.get().export(self.spans)
+        self.spans = []
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_span(span: Span) -> dict:
+    status = {'code': span.status}  # type: dict[str, Any]
+    if span.status_message:
+        status['message'] = span.status_message
+    result = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        'kind': 1,
+        'startTimeUnixNano': str(span.start),
+        'endTimeUnixNano': str(span.end or span.start),
+        'attributes': [
+            {'key': key, 'value': _otlp_value(value)}
+            for key, value in span.attributes.items()
+        ],
+        'status': status,
+    }
+    if span.parent_id is not None:
+        result['parentSpanId'] = span.parent_id
+    return result
+
+
+def otlp_payload(spans: list[Span], service_name: str) -> dict:
+    return {
+        'resourceSpans': [{
+            'resource': {
+                'attributes': [
+                    {'key': 'service.name', 'value': _otlp_value(service_name)},
+                    {'key': 'service.version', 'value': _otlp_value(PACKAGE_VERSION)},
+                ],
+            },
+            'scopeSpans': [{
+                'scope': {'name': PACKAGE_NAME, 'version': PACKAGE_VERSION},
+                'spans': [_otlp_span(span) for span in spans],
+            }],
+        }],
+    }
+
+
+class SpanExporter(abc.ABC):
+
+    def __init__(self, service_name: str):
+        self.service_name = service_name
+
+    @abc.abstractmethod
+    def export(self, spans: list[Span]):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends OTLP/JSON payloads as lines (as the collector file exporter)"""
+
+    def __init__(self, service_name: str, path: str):
+        super().__init__(service_name)
+        self.path = pathlib.Path(path)
+
+    def export(self, spans: list[Span]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open(mode='a', encoding='utf-8') as fp:
+            fp.write(json.dumps(otlp_payload(spans, self.service_name)))
+            fp.write('\n')
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+
+    def __init__(self, service_name: str, endpoint: str, timeout: int):
+        super().__init__(service_name)
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def export(self, spans: list[Span]):
+        r = self.session.post(
+            url=self.endpoint,
+            json=otlp_payload(spans, self.service_name),
+            timeout=self.timeout,
+        )
+        r.raise_for_status()
+
+    def shutdown(self):
+        self.session.close()
+
+
+EXPORTERS = {
+    'file': lambda cfg: FileSpanExporter(
+        service_name=cfg.tracing.service_name,
+        path=cfg.tracing.file,
+    ),
+    'otlp': lambda cfg: OtlpHttpSpanExporter(
+        service_name=cfg.tracing.service_name,
+        endpoint=cfg.tracing.endpoint,
+        timeout=cfg.tracing.timeout,
+    ),
+}
+
+
+class Tracer:
+    """Exports finished traces in batches from a background thread"""
+    _instance = None
+
+    BATCH_SIZE = 512
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self):
+        self.cfg = None
+        self.exporter = None  # type: Optional[SpanExporter]
+        self.queue = queue.SimpleQueue()  # type: queue.SimpleQueue
+        self.thread = None  # type: Optional[threading.Thread]
+
+    @classmethod
+    def init(cls, config: SubmitterConfig):
+        instance = cls.get()
+        instance.shutdown()
+        instance.cfg = config
+        if not config.tracing.enabled:
+            return
+        factory = EXPORTERS.get(config.tracing.exporter, None)
+        if factory is None:
+            LOG.warning('Unknown tracing exporter: %s', config.tracing.exporter)
+            return
+        instance.exporter = factory(config)
+        instance.thread = threading.Thread(
+            target=instance._run,
+            name='span-exporter',
+            daemon=True,
+        )
+        instance.thread.start()
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = Tracer()
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start(self, submission_id: str, traceparent: Optional[str] = None,
+              record: bool = False) -> Trace:
+        # record: keep spans (e.g. for timings) even if not exported
+        return Trace(
+            submission_id=submission_id,
+            traceparent=traceparent,
+            enabled=self.enabled or record,
+            exported=self.enabled,
+        )
+
+    def export(self, spans: list[Span]):
+        if self.enabled:
+            self.queue.put(spans)
+
+    def _export(self, batch: list[Span]):
+        if len(batch) == 0 or self.exporter is None:
+            return
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            LOG.warning('Failed to export %d spans: %s', len(batch), e)
+
+    def _run(self):
+        batch = []  # type: list[Span]
+        deadline = time.monotonic() + self.FLUSH_INTERVAL
+        while True:
+            try:
+                spans = self.queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                spans = []
+            if spans is None:
+                self._export(batch)
+                return
+            batch.extend(spans)
+            if len(batch) >= self.BATCH_SIZE or time.monotonic() >= deadline:
+                self._export(batch)
+                batch = []
+                deadline = time.monotonic() + self.FLUSH_INTERVAL
+
+    def shutdown(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+            self.thread = None
+        if self.exporter is not None:
+            self.exporter.shutdown()
+            self.exporter = None
+
+
+atexit.register(lambda: Tracer.get().shutdown())
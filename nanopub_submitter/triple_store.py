@@ -1,36 +1,19 @@
 import itertools
-import logging
-import rdflib  # type: ignore
-import SPARQLWrapper  # type: ignore
+import requests.auth
 
-from typing import List
+from typing import List, Optional
 
+from nanopub_submitter.compression import compress, normalize_encoding, ENCODING_IDENTITY
 from nanopub_submitter.config import SubmitterConfig
+from nanopub_submitter.connections import get_session
 from nanopub_submitter.consts import COMMENT_INSTRUCTION_DELIMITER, \
-    COMMENT_POST_QUERY_PREFIX, COMMENT_PRE_QUERY_PREFIX
+    COMMENT_POST_QUERY_PREFIX, COMMENT_PRE_QUERY_PREFIX, DEFAULT_ENCODING
+from nanopub_submitter.logger import LOG
+from nanopub_submitter.quadstore import parse_rdf, iri_n3
 
 
-GRAPH_CLASSES = {
-    'Graph': rdflib.Graph,
-    'ConjunctiveGraph': rdflib.ConjunctiveGraph,
-    'QuotedGraph': rdflib.graph.QuotedGraph,
-    'Dataset': rdflib.graph.Dataset,
-}
-
-
-def create_graph(class_name: str) -> rdflib.Graph:
-    return GRAPH_CLASSES.get(class_name, rdflib.Graph)()
-
-
-def _n3(node: rdflib.term.Node) -> str:
-    if isinstance(node, rdflib.URIRef):
-        return node.n3()
-    elif isinstance(node, rdflib.Literal):
-        return node.n3()
-    elif isinstance(node, rdflib.BNode):
-        return node.n3()
-    else:
-        raise ValueError(f'Unknown node type: {type(node)}')
+# graph classes iterating triples of all graphs (others only the default one)
+UNION_GRAPH_CLASSES = ('ConjunctiveGraph',)
 
 
 class QueryBuilder:
@@ -59,27 +42,27 @@ class QueryBuilder:
                 query = line.split(COMMENT_INSTRUCTION_DELIMITER, maxsplit=1)[1].strip()
                 self.post_queries.append(query)
 
-    def delete_graph(self, graph_node):
-        self.add(f'DROP SILENT GRAPH {graph_node.n3()} ;')
+    def delete_graph(self, graph_node: str):
+        self.add(f'DROP SILENT GRAPH {graph_node} ;')
 
-    def create_graph(self, graph_node):
-        self.add(f'CREATE GRAPH {graph_node.n3()} ;')
+    def create_graph(self, graph_node: str):
+        self.add(f'CREATE GRAPH {graph_node} ;')
 
-    def insert_data(self, triples: List[str], graph_node=None):
+    def insert_data(self, triples: List[str], graph_node: Optional[str] = None):
         if graph_node is None:
             self.add('INSERT DATA {')
             self.add_all(triples)
             self.add('} ;')
         else:
-            self.add(f'INSERT DATA {{ GRAPH {graph_node.n3()} {{')
+            self.add(f'INSERT DATA {{ GRAPH {graph_node} {{')
             self.add_all(triples)
             self.add('} } ;')
 
     def insert_multigraph_start(self):
         self.add('INSERT DATA {')
 
-    def insert_multigraph(self, triples: List[str], graph_node=None):
-        self.add(f'GRAPH {graph_node.n3()} {{')
+    def insert_multigraph(self, triples: List[str], graph_node: str):
+        self.add(f'GRAPH {graph_node} {{')
         self.add_all(triples)
         self.add('}')
 
@@ -97,18 +80,18 @@ class QueryBuilder:
 def basic_query_builder(cfg: SubmitterConfig, data: str, input_format: str) -> str:
     """It will simply inserts triples to a triple store or to a graph based on given type"""
     qb = QueryBuilder.prepare(cfg, data)
-    g = create_graph(cfg.triple_store.graph_class)
-    g.parse(data=data, format=input_format)
+    store = parse_rdf(data=data, input_format=input_format)
+    union = cfg.triple_store.graph_class in UNION_GRAPH_CLASSES
     triples = [
-        f'{_n3(s)} {_n3(p)} {_n3(o)} .' for s, p, o in g
+        f'{s} {p} {o} .' for s, p, o in store.triples(union=union)
     ]
     if cfg.triple_store.graph_named is True and cfg.triple_store.graph_type:
-        t = rdflib.URIRef(cfg.triple_store.graph_type)
-        graph_node = None
-        for s, p, o in g.triples((None, rdflib.RDF.type, t)):
-            graph_node = s
+        t = iri_n3(cfg.triple_store.graph_type)
+        subjects = store.subjects_of_type(t, union=union)
+        graph_node = subjects[-1] if len(subjects) > 0 else None
         if graph_node is None:
-            logging.warning(f'Graph URI not found (type: {t})')
+            LOG.warning('Graph URI not found (type: %s)', t)
+            raise ValueError(f'Graph URI not found (type: {t})')
         qb.delete_graph(graph_node)
         qb.create_graph(graph_node)
         qb.insert_data(triples, graph_node=graph_node)
@@ -120,18 +103,18 @@ def basic_query_builder(cfg: SubmitterConfig, data: str, input_format: str) -> s
 def multi_graph_query_builder(cfg: SubmitterConfig, data: str, input_format: str) -> str:
     """It will inserts the triples for each graph from given quads"""
     qb = QueryBuilder.prepare(cfg, data)
-    cg = rdflib.ConjunctiveGraph()
-    cg.parse(data=data, format=input_format)
+    store = parse_rdf(data=data, input_format=input_format)
 
     qb.insert_multigraph_start()
-    for ctx in cg.contexts():
+    qb.add_all([f'{s} {p} {o} .' for s, p, o in store.triples()])
+    for ctx in store.contexts():
         triples = [
-            f'{_n3(s)} {_n3(p)} {_n3(o)} .'
-            for s, p, o in cg.triples((None, None, None), context=ctx)
+            f'{s} {p} {o} .'
+            for s, p, o in store.triples(context=ctx)
         ]
-        qb.insert_multigraph(triples=triples, graph_node=ctx.identifier)
+        qb.insert_multigraph(triples=triples, graph_node=ctx)
     else:
-        logging.warning('No graphs found in given RDF')
+        LOG.warning('No graphs found in given RDF')
     qb.insert_multigraph_finish()
 
     return qb.query
@@ -151,11 +134,35 @@ def build_query(cfg: SubmitterConfig, data: str, input_format: str) -> str:
     return query_strategy(cfg, data, input_format)
 
 
-def store_to_triple_store(cfg: SubmitterConfig, data: str, input_format: str):
-    query = build_query(cfg, data, input_format)
+def _update_compressed(cfg: SubmitterConfig, query: str, encoding: str):
+    auth = None  # type: Optional[requests.auth.AuthBase]
+    if cfg.triple_store.auth_method and cfg.triple_store.auth_method.upper() != 'NONE':
+        auth_class = requests.auth.HTTPDigestAuth \
+            if cfg.triple_store.auth_method.upper() == 'DIGEST' \
+            else requests.auth.HTTPBasicAuth
+        auth = auth_class(cfg.triple_store.auth_username, cfg.triple_store.auth_password)
+    r = get_session().post(
+        url=cfg.triple_store.sparql_endpoint,
+        data=compress(query.encode(DEFAULT_ENCODING), encoding),
+        headers={
+            'Content-Type': f'application/sparql-update; charset={DEFAULT_ENCODING}',
+            'Content-Encoding': encoding,
+        },
+        auth=auth,
+        timeout=cfg.triple_store.timeout,
+    )
+    r.raise_for_status()
 
+
+def update_triple_store(cfg: SubmitterConfig, query: str):
+    encoding = normalize_encoding(cfg.triple_store.compression)
+    if encoding != ENCODING_IDENTITY:
+        _update_compressed(cfg, query, encoding)
+        return
+    import SPARQLWrapper  # type: ignore
     sparql = SPARQLWrapper.SPARQLWrapper(cfg.triple_store.sparql_endpoint)
     sparql.setMethod('POST')
+    sparql.setTimeout(cfg.triple_store.timeout)
 
     if cfg.triple_store.auth_method:
         sparql.setHTTPAuth(SPARQLWrapper.BASIC)
@@ -164,3 +171,8 @@ def store_to_triple_store(cfg: SubmitterConfig, data: str, input_format: str):
     sparql.setQuery(query)
     sparql.setReturnFormat(SPARQLWrapper.JSON)
     sparql.query().convert()
+
+
+def store_to_triple_store(cfg: SubmitterConfig, data: str, input_format: str):
+    query = build_query(cfg, data, input_format)
+    update_triple_store(cfg, query)
@@ -0,0 +1,152 @@
+import collections
+
+from typing import Optional
+
+from nanopub_submitter.config import ValidationConfig
+from nanopub_submitter.quadstore import QuadStore, iri_n3, n3_value
+
+NP_NAMESPACE = 'http://www.nanopub.org/nschema#'
+NP_NANOPUBLICATION = f'{NP_NAMESPACE}Nanopublication'
+NP_HAS_ASSERTION = f'{NP_NAMESPACE}hasAssertion'
+NP_HAS_PROVENANCE = f'{NP_NAMESPACE}hasProvenance'
+NP_HAS_PUBINFO = f'{NP_NAMESPACE}hasPublicationInfo'
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+THIS_PREFIX = '@prefix this:'
+
+PART_PREDICATES = {
+    'assertion': NP_HAS_ASSERTION,
+    'provenance': NP_HAS_PROVENANCE,
+    'pubinfo': NP_HAS_PUBINFO,
+}
+LINK_PREDICATES = frozenset(PART_PREDICATES.values())
+
+
+class NanopubValidationError(ValueError):
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class NanopubStats:
+
+    def __init__(self, uri: str, head: str, parts: dict[str, str],
+                 triples: int):
+        self.uri = uri
+        self.head = head
+        self.parts = parts
+        self.triples = triples
+
+    @property
+    def graphs(self) -> int:
+        return 1 + len(self.parts)
+
+
+class StructureIndex:
+    """Just enough of the quads to check the nanopub structure"""
+
+    def __init__(self):
+        self.graph_sizes = collections.Counter()  # type: collections.Counter[str]
+        self.nanopubs = []  # type: list[tuple[str, str]]
+        self.links = collections.defaultdict(list)  # type: dict[tuple, list[str]]
+        self.this_uri = None  # type: Optional[str]
+
+    def add(self, s: str, p: str, o: str, g: str):
+        self.graph_sizes[g] += 1
+        if p == RDF_TYPE and o == NP_NANOPUBLICATION:
+            self.nanopubs.append((s, g))
+        elif p in LINK_PREDICATES:
+            self.links[(g, s, p)].append(o)
+
+    @property
+    def triples(self) -> int:
+        return sum(self.graph_sizes.values())
+
+    @classmethod
+    def from_store(cls, store: QuadStore) -> 'StructureIndex':
+        index = cls()
+        terms = store.terms
+        for g, size in collections.Counter(store.g).items():
+            index.graph_sizes[n3_value(terms[g])] = size
+        rdf_type = store.lookup(iri_n3(RDF_TYPE))
+        nanopub_class = store.lookup(iri_n3(NP_NANOPUBLICATION))
+        links = {store.lookup(iri_n3(p)) for p in LINK_PREDICATES} - {None}
+        for s, p, o, g in store.quads_ids():
+            if p == rdf_type and o == nanopub_class:
+                index.nanopubs.append((n3_value(terms[s]), n3_value(terms[g])))
+            elif p in links:
+                key = (n3_value(terms[g]), n3_value(terms[s]), n3_value(terms[p]))
+                index.links[key].append(n3_value(terms[o]))
+        index.this_uri = store.resolve('this')
+        return index
+
+
+def count_this_prefixes(data: str) -> int:
+    return sum(1 for line in data.splitlines() if line.startswith(THIS_PREFIX))
+
+
+def _check_nanopub(index: StructureIndex, uri: str, head: str) -> NanopubStats:
+    parts = dict()  # type: dict[str, str]
+    triples = index.graph_sizes[head]
+    for part, predicate in PART_PREDICATES.items():
+        objects = index.links.get((head, uri, predicate), [])
+        if len(objects) != 1:
+            raise NanopubValidationError(
+                f'Nanopub <{uri}>: head graph <{head}> must link '
+                f'exactly one {part} graph (<{predicate}>)'
+            )
+        part_id = objects[0]
+        if part_id == head or part_id in parts.values():
+            raise NanopubValidationError(
+                f'Nanopub <{uri}>: {part} graph <{part_id}> is not a separate graph'
+            )
+        size = index.graph_sizes.get(part_id, 0)
+        if size == 0:
+            raise NanopubValidationError(
+                f'Nanopub <{uri}>: {part} graph <{part_id}> referenced '
+                f'from head graph is missing or empty'
+            )
+        parts[part] = part_id
+        triples += size
+    return NanopubStats(
+        uri=uri,
+        head=head,
+        parts=parts,
+        triples=triples,
+    )
+
+
+def validate_index(index: StructureIndex, cfg: ValidationConfig,
+                   this_prefixes: Optional[int] = None) -> list[NanopubStats]:
+    """Checks structure of nanopubs (before running np)"""
+    if this_prefixes == 0:
+        raise NanopubValidationError(f'Missing "{THIS_PREFIX}" declaration')
+    heads = index.nanopubs
+    if len(heads) == 0:
+        raise NanopubValidationError(
+            f'No head graph found (no resource of type <{NP_NANOPUBLICATION}>)'
+        )
+    if this_prefixes is not None and len(heads) != this_prefixes:
+        raise NanopubValidationError(
+            f'Found {len(heads)} nanopub(s) but {this_prefixes} "{THIS_PREFIX}" '
+            f'declaration(s), each nanopub needs its own'
+        )
+    if index.this_uri is not None and index.this_uri not in {uri for uri, _ in heads}:
+        raise NanopubValidationError(
+            f'"{THIS_PREFIX}" <{index.this_uri}> does not denote any nanopub '
+            f'(resource of type <{NP_NANOPUBLICATION}>)'
+        )
+    if 0 < cfg.max_nanopubs < len(heads):
+        raise NanopubValidationError(
+            f'Too many nanopubs: {len(heads)} (limit: {cfg.max_nanopubs})'
+        )
+    result = []
+    for uri, head in heads:
+        stats = _check_nanopub(index, uri, head)
+        if 0 < cfg.max_triples < stats.triples:
+            raise NanopubValidationError(
+                f'Nanopub <{uri}> is too large: {stats.triples} triples '
+                f'(limit: {cfg.max_triples})'
+            )
+        result.append(stats)
+    return result
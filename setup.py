@@ -23,7 +23,14 @@ setup(
         'requests',
         'SPARQLWrapper',
         'uvicorn[standard]',
+        'zstandard',
     ],
+    entry_points={
+        'console_scripts': [
+            'nanopub-bulk-import=nanopub_submitter.bulk:main',
+            'nanopub-replay=nanopub_submitter.replay:main',
+        ],
+    },
     classifiers=[
         'License :: OSI Approved :: Apache Software License',
         'Programming Language :: Python',
@@ -0,0 +1,33 @@
+import io
+import pytest
+
+from fastapi.testclient import TestClient
+
+from nanopub_submitter import app
+from nanopub_submitter.config import cfg_parser
+from nanopub_submitter.consts import ENV_CONFIG
+
+BASE_CONFIG = """
+nanopub:
+  servers: [http://127.0.0.1:1/]
+  client_exec: /bin/false
+  workdir: {workdir}
+"""
+
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    def _make(extra: str = ''):
+        config_file = tmp_path / 'config.yml'
+        config_file.write_text(BASE_CONFIG.format(workdir=tmp_path / 'work') + extra)
+        monkeypatch.setenv(ENV_CONFIG, str(config_file))
+        return TestClient(app)
+    return _make
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    def _make(extra: str = ''):
+        text = BASE_CONFIG.format(workdir=tmp_path / 'work') + extra
+        return cfg_parser.parse_file(fp=io.StringIO(text))
+    return _make
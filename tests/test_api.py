@@ -0,0 +1,36 @@
+from nanopub_submitter.cache import NanopubCache
+
+
+def test_submit_invalid_utf8(make_client):
+    with make_client() as client:
+        r = client.post(
+            '/submit',
+            content=b'@prefix this: <\xff\xfe> .',
+            headers={'Content-Type': 'application/trig'},
+        )
+    assert r.status_code == 400
+    assert 'Failed to decode body' in r.text
+
+
+CACHE_CONFIG = """
+cache:
+  enabled: true
+"""
+
+
+def test_get_nanopub_if_none_match_missing(make_client):
+    with make_client(CACHE_CONFIG) as client:
+        r = client.get('/nanopubs/RAnotexist', headers={'If-None-Match': '*'})
+    assert r.status_code == 404
+
+
+def test_get_nanopub_if_none_match_existing(make_client):
+    with make_client(CACHE_CONFIG) as client:
+        NanopubCache.get().put('RAexisting', b'<a> <b> <c> <d> .\n')
+        r = client.get('/nanopubs/RAexisting', headers={'If-None-Match': '*'})
+        assert r.status_code == 304
+        etag = r.headers['ETag']
+        r = client.get('/nanopubs/RAexisting', headers={'If-None-Match': '"other"'})
+        assert r.status_code == 200
+        r = client.get('/nanopubs/RAexisting', headers={'If-None-Match': etag})
+        assert r.status_code == 304
@@ -0,0 +1,33 @@
+import time
+
+from nanopub_submitter.limits import SubmissionLimiter
+
+LIMITS_CONFIG = """
+security:
+  limits:
+    enabled: true
+    rate: 1000
+    burst: 2
+"""
+
+
+def test_idle_tenants_evicted(make_config):
+    SubmissionLimiter.init(config=make_config(LIMITS_CONFIG))
+    limiter = SubmissionLimiter.get()
+    for tenant in ('10.0.0.1', '10.0.0.2'):
+        assert limiter.admit(tenant) is None
+    limiter.finish('10.0.0.1')
+    time.sleep(0.01)  # buckets refilled
+    limiter.swept -= SubmissionLimiter.SWEEP_INTERVAL
+    assert limiter.admit('10.0.0.3') is None
+    assert set(limiter.tenants) == {'10.0.0.2', '10.0.0.3'}
+
+
+def test_tenants_not_evicted_before_interval(make_config):
+    SubmissionLimiter.init(config=make_config(LIMITS_CONFIG))
+    limiter = SubmissionLimiter.get()
+    assert limiter.admit('10.0.0.1') is None
+    limiter.finish('10.0.0.1')
+    time.sleep(0.01)
+    assert limiter.admit('10.0.0.2') is None
+    assert set(limiter.tenants) == {'10.0.0.1', '10.0.0.2'}
@@ -0,0 +1,24 @@
+import time
+
+from nanopub_submitter.replay import Replayer
+
+
+def test_replay_paces_by_arrival(monkeypatch):
+    replayer = Replayer(target='http://localhost', token=None, speed=1.0,
+                        concurrency=1, timeout=1)
+    started = time.monotonic()
+    sent = []
+    monkeypatch.setattr(replayer, '_send', lambda entry: sent.append(
+        (entry['submission_id'], time.monotonic() - started),
+    ))
+    # slow first request completed (and was captured) last
+    entries = [
+        {'submission_id': 'b', 'arrival': 100.1},
+        {'submission_id': 'c', 'arrival': 100.2},
+        {'submission_id': 'a', 'arrival': 100.0},
+    ]
+    replayer.run(entries)
+    assert [s[0] for s in sent] == ['a', 'b', 'c']
+    assert sent[1][1] >= 0.1
+    assert sent[2][1] >= 0.2
+    assert replayer.max_lag < 0.1
@@ -0,0 +1,49 @@
+from nanopub_submitter import nanopub
+from nanopub_submitter.config import RequestConfig
+from nanopub_submitter.nanopub import NanopubProcessingContext
+from nanopub_submitter.tracing import Tracer, TRACEPARENT_HEADER
+
+TRACEPARENT = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+
+
+class FakeResponse:
+    ok = True
+    status_code = 201
+    text = ''
+
+
+class FakeSession:
+
+    def __init__(self):
+        self.headers = []
+
+    def post(self, headers, **kwargs):
+        self.headers.append(headers)
+        return FakeResponse()
+
+
+def _post(monkeypatch, config, trace) -> dict:
+    session = FakeSession()
+    monkeypatch.setattr(nanopub, 'get_session', lambda: session)
+    ctx = NanopubProcessingContext(
+        submission_id='test',
+        cfg=config,
+        req_cfg=RequestConfig(servers=[], uri_replace=None),
+        trace=trace,
+    )
+    with trace.span('submit'):
+        assert nanopub._post_nanopub(server='http://np.example', nanopub='', ctx=ctx)
+    return session.headers[0]
+
+
+def test_capture_only_does_not_propagate(monkeypatch, make_config):
+    trace = Tracer().start(submission_id='test', record=True)
+    assert trace.recording
+    headers = _post(monkeypatch, make_config(), trace)
+    assert TRACEPARENT_HEADER not in headers
+
+
+def test_capture_only_passes_remote_parent(monkeypatch, make_config):
+    trace = Tracer().start(submission_id='test', traceparent=TRACEPARENT, record=True)
+    headers = _post(monkeypatch, make_config(), trace)
+    assert headers[TRACEPARENT_HEADER].startswith('00-0af7651916cd43dd8448eb211c80319c-')
@@ -0,0 +1,57 @@
+import SPARQLWrapper  # type: ignore
+import pytest
+
+from nanopub_submitter import triple_store
+
+
+class FakeResponse:
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+
+    def __init__(self):
+        self.requests = []
+
+    def post(self, **kwargs):
+        self.requests.append(kwargs)
+        return FakeResponse()
+
+
+class FakeResult:
+
+    def convert(self):
+        return {}
+
+
+def _config(make_config, compression: str):
+    return make_config(f"""
+triple_store:
+  enabled: true
+  sparql_endpoint: http://127.0.0.1:1/sparql
+  compression: {compression}
+  timeout: 7
+""")
+
+
+def test_compressed_update_has_timeout(monkeypatch, make_config):
+    session = FakeSession()
+    monkeypatch.setattr(triple_store, 'get_session', lambda: session)
+    triple_store.update_triple_store(cfg=_config(make_config, 'gzip'), query='INSERT DATA {}')
+    assert session.requests[0]['timeout'] == 7
+    assert session.requests[0]['headers']['Content-Encoding'] == 'gzip'
+
+
+@pytest.mark.parametrize('compression', ['none', 'identity', 'None'])
+def test_uncompressed_update(monkeypatch, make_config, compression):
+    session = FakeSession()
+    monkeypatch.setattr(triple_store, 'get_session', lambda: session)
+    timeouts = []
+    monkeypatch.setattr(SPARQLWrapper.SPARQLWrapper, 'setTimeout',
+                        lambda self, timeout: timeouts.append(timeout))
+    monkeypatch.setattr(SPARQLWrapper.SPARQLWrapper, 'query', lambda self: FakeResult())
+    triple_store.update_triple_store(cfg=_config(make_config, compression), query='INSERT DATA {}')
+    assert session.requests == []
+    assert timeouts == [7]